@@ -202,7 +202,7 @@ class pyTenma:
             if len(times)<2:
                 continue
             if abs(times[-1]-times[-2])>.1:
-                if vals[-1]==vals[-1]:
+                if vals[-1]==vals[-2]:
                     break
                 else:
                     print("values did not match! repeating measurement.")
@@ -5,22 +5,41 @@ Those serial port are emulated with chip driver
 which could be recognized thank to its VID/PID.
 Then, with the hardware ID of each serial port,
 the control boards are identified.
+
+Each board is driven by a single byte, one bit per relay: manage_relay()
+switches one relay, apply() several ones at once, with a single command
+per board and a single settle delay. Within a batch() block, every
+manage_relay() and apply() call is gathered into a single apply():
+
+    with control_relay.batch():
+        control_relay.manage_relay('B', 1, State.Enable)
+        control_relay.manage_relay('B', 2, State.Enable)
 '''
 
+from contextlib import contextmanager
 import serial
 from time import sleep
+from typing import Iterator
 
 from ..utils.utils import (
     enumerate_serial, get_all_serial_with_hwid,
     State)
 
 
+BOARDS = ('A', 'B', 'C', 'D')
+# Time (s) for the relays to switch, once their board got its command
+SETTLE_DELAY = 0.1
+
+
 class ControlRelay:
     baudrate = 9600
 
     def __init__(self, verbose=False):
         # Set debug flag
         self._verbose = verbose
+        # Relay states gathered by batch(), and its nesting depth
+        self._batch_states = {}
+        self._batch_depth = 0
         # Initialize connection to control relay board
         self._initialize_connection()
         # Check connection
@@ -32,62 +51,35 @@ class ControlRelay:
         self._configure_relay_board(self._control_relay_d)
 
     def manage_relay(self, board: str, relay: int, state: State):
-        if relay not in range(1, 9):
-            raise ValueError('Relay could only be in range 1 to 8.')
-        if board not in ['A', 'B', 'C', 'D']:
-            raise ValueError(
-                'Only control relay board A, B, C or D are managed.')
-        if board == 'A':
-            # Update the command value of board A
-            self._command_a = self._update_command(
-                self._command_a,
-                relay,
-                state)
-            # Send command to board A
-            self._send_command(
-                self._control_relay_a,
-                self._command_a
-            )
-        elif board == 'B':
-            # Update the command value of board B
-            self._command_b = self._update_command(
-                self._command_b,
-                relay,
-                state)
-            # Send command to board B
-            self._send_command(
-                self._control_relay_b,
-                self._command_b
-            )
-        elif board == 'C':
-            # Update the command value of board C
-            self._command_c = self._update_command(
-                self._command_c,
-                relay,
-                state)
-            # Send command to board C
-            self._send_command(
-                self._control_relay_c,
-                self._command_c
-            )
-        elif board == 'D':
-            # Update the command value of board D
-            self._command_d = self._update_command(
-                self._command_d,
-                relay,
-                state)
-            # Send command to board D
-            self._send_command(
-                self._control_relay_d,
-                self._command_d
-            )
-        # Wait for treatment
-        sleep(0.1)
-        # Verbosity purpose
-        if self._verbose:
-            print(
-                f'Board \'{board}\': '
-                f'Relay n°{relay} {state.name}')
+        self.apply({(board, relay): state})
+
+    def apply(self, states: dict[tuple[str, int], State]):
+        '''Set the relays of states {(board, relay): state},
+        with one command per board, then wait for them once.
+
+        Within batch(), the relays are set when the batch ends.'''
+
+        for board, relay in states:
+            self._check_relay(board, relay)
+        if self._batch_depth > 0:
+            self._batch_states.update(states)
+        else:
+            self._apply_states(states)
+
+    @contextmanager
+    def batch(self) -> Iterator['ControlRelay']:
+        '''Gather the manage_relay() and apply() calls of the with block
+        into a single apply(), done when the block ends.'''
+
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                states = self._batch_states
+                self._batch_states = {}
+                self._apply_states(states)
 
     def __del__(self):
         # Disconnect relays board A
@@ -226,6 +218,38 @@ class ControlRelay:
                 port_and_id.append((port, hwid[-1:].upper()))
         return port_and_id
 
+    def _check_relay(self, board: str, relay: int):
+        if relay not in range(1, 9):
+            raise ValueError('Relay could only be in range 1 to 8.')
+        if board not in BOARDS:
+            raise ValueError(
+                'Only control relay board A, B, C or D are managed.')
+
+    def _apply_states(self, states: dict[tuple[str, int], State]):
+        if not states:
+            return
+        # Final command value of each board
+        commands = {}
+        for (board, relay), state in states.items():
+            commands[board] = self._update_command(
+                commands.get(board, getattr(self, f'_command_{board.lower()}')),
+                relay,
+                state)
+        # Send a single command to each board
+        for board, command in commands.items():
+            setattr(self, f'_command_{board.lower()}', command)
+            self._send_command(
+                getattr(self, f'_control_relay_{board.lower()}'),
+                command)
+        # Wait for treatment
+        sleep(SETTLE_DELAY)
+        # Verbosity purpose
+        if self._verbose:
+            for (board, relay), state in states.items():
+                print(
+                    f'Board \'{board}\': '
+                    f'Relay n°{relay} {state.name}')
+
     def _send_command(self, ser: serial.Serial, value: int):
         command = self._format_command(value)
         ser.write(command)
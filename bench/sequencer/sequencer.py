@@ -1,6 +1,5 @@
 from subprocess import CompletedProcess, TimeoutExpired
-import usb.core
-from time import sleep
+from time import sleep, monotonic
 from datetime import date
 from sys import exit
 from os import system
@@ -9,12 +8,13 @@ from enum import Enum, auto
 
 from bench.control_relay.control_relay import ControlRelay
 from bench.tenma.tenma_dc_power import Tenma_72_2535_manage
-from bench.tenma.tenma_multimeter import Tenma_72_7730A_manage
+from bench.tenma.multimeter_discovery import get_bcd_devices, discover_multimeters
 from bench.logger.logger import Logger
 from bench.bms3_interface.bms3_command import BMS3Command, INVALID_VALUE
 
 from bench.utils.utils import State
 from bench.utils.menus import Menu, menu_frame_design
+from bench.utils.window_statistics import WindowStatistics
 
 # Test parameters
 VOLTAGE_MEASUREMENT_LOW_THRESHOLD = 5               # mV
@@ -36,6 +36,22 @@ CURRENT_CONSOMPTION_SLEEP_MODE_HIGH_THRESHOLD = 10  # µA
 BATTERY_CHARGE_CURRENT_HIGH_THRESHOLD = 270         # mA
 BATTERY_CHARGE_CURRENT_LOW_THRESHOLD = 230          # mA
 LED_COLOR_STEP_NUMBER = 4                           # RGB and White
+# Multimeter settling: consecutive readings which shall converge
+SETTLE_SAMPLES = 2
+VOLTAGE_SETTLE_TOLERANCE = 2                        # mV
+CURRENT_SETTLE_TOLERANCE = 1                        # µA
+# Part of the acceptance range the readings shall converge within
+SETTLE_RANGE_RATIO = 20
+# Minimum wait (s) of each multimeter for readings taken after a switch
+SETTLE_MIN_TIMEOUT = 0.5
+# Time (s) for the BMS3 to react to a current measurement switch,
+# readings taken before are ignored
+CURRENT_SWITCH_DWELL = 1
+# Time (s) for the BMS3 battery voltage measurement to settle,
+# after each Tenma DC power step
+BMS3_VOLTAGE_SETTLE_TIME = 1
+# Checks use the mean of the readings of the last STATISTICS_WINDOW (s)
+STATISTICS_WINDOW = 0.5
 
 # Logging
 LOGGING_FOLDER = "../../logging"
@@ -45,12 +61,32 @@ LOG_COLUMNS_WIDTH = [5, 35, 17, 75]
 # Multimeter
 ID_PRODUCT = 0xE008
 ID_VENDOR = 0x1A86
+# Folder to record the raw multimeter reports in, None to disable
+MULTIMETER_RECORDING_FOLDER = None
+# Serial ports of the multimeters on optical serial cables, if any
+MULTIMETER_SERIAL_PORTS = []
 
 # Tenma DC power
 MAX_BMS3_VOLTAGE = 3500     # mV
 MAX_BMS3_CURRENT = 110      # mA
 MAX_USB_VOLTAGE = 5000      # mV
 MAX_USB_CURRENT = 400       # mA
+REPROG_BMS3_VOLTAGE = 3333  # mV
+# Operating points stored in Tenma DC power memories M1 to M5
+# {slot: (voltage in mV, current in mA)}
+# Each session overwrites the slots listed here (M1 to M3), whatever
+# has been stored in them from the front panel: change the slot numbers
+# to keep them for other uses.
+TENMA_DC_PRESETS = {
+    1: (MAX_BMS3_VOLTAGE, MAX_BMS3_CURRENT),
+    2: (MAX_USB_VOLTAGE, MAX_USB_CURRENT),
+    3: (REPROG_BMS3_VOLTAGE, MAX_BMS3_CURRENT)}
+# Display the Tenma DC power command latencies at the end of the session
+TENMA_DC_LATENCY_REPORT = False
+# Pipelined transport and command gap learning, only validated against
+# the emulator (python -m bench.tenma -emulator) so far
+TENMA_DC_PIPELINED = False
+TENMA_DC_LEARN_COMMAND_GAP = False
 
 
 # Enum
@@ -84,7 +120,11 @@ class Bms3Sequencer():
         self._reprog_in_progress = False
         # Set bench control device
         self._control_relay = ControlRelay()
-        self._tenma_dc_power = Tenma_72_2535_manage()
+        self._tenma_dc_power = Tenma_72_2535_manage(
+            pipelined=TENMA_DC_PIPELINED,
+            learn_command_gap=TENMA_DC_LEARN_COMMAND_GAP,
+            record_latency=TENMA_DC_LATENCY_REPORT)
+        self._tenma_dc_power.provision_presets(TENMA_DC_PRESETS)
         # Set measurement tools
         self._set_multimeter()
         # Set logger
@@ -207,19 +247,21 @@ class Bms3Sequencer():
 
     def connect_reprog(self):
         self._reprog_in_progress = True
-        self._activate_relay(self._relay_swclk)
-        self._activate_relay(self._relay_nrst)
-        self._activate_relay(self._relay_swdio)
-        self._activate_relay(self._relay_2V5)
-        self._activate_relay(self._relay_gnd)
+        with self._control_relay.batch():
+            self._activate_relay(self._relay_swclk)
+            self._activate_relay(self._relay_nrst)
+            self._activate_relay(self._relay_swdio)
+            self._activate_relay(self._relay_2V5)
+            self._activate_relay(self._relay_gnd)
 
     def disconnect_reprog(self):
         self._reprog_in_progress = False
-        self._desactivate_relay(self._relay_swclk)
-        self._desactivate_relay(self._relay_nrst)
-        self._desactivate_relay(self._relay_swdio)
-        self._desactivate_relay(self._relay_2V5)
-        self._desactivate_relay(self._relay_gnd)
+        with self._control_relay.batch():
+            self._desactivate_relay(self._relay_swclk)
+            self._desactivate_relay(self._relay_nrst)
+            self._desactivate_relay(self._relay_swdio)
+            self._desactivate_relay(self._relay_2V5)
+            self._desactivate_relay(self._relay_gnd)
 
     # Connect/disconnected Vout
     def connect_low_load(self):
@@ -252,9 +294,14 @@ class Bms3Sequencer():
 
     def activate_current_measurement_and_check_reset(self):
         self.activate_current_measurement()
-        sleep(2)
+        # The readings right after the switch don't show a reset yet
+        current_measurement = self._ampmeter.wait_stable(
+            CURRENT_SETTLE_TOLERANCE,
+            SETTLE_SAMPLES,
+            timeout=2,
+            since=monotonic() + CURRENT_SWITCH_DWELL).measurement
         # Check if the BMS3 isn't reset after current measurement activation
-        if self._ampmeter.get_measurement() < CURRENT_CONSOMPTION_SLEEP_MODE_LOW_THRESHOLD:
+        if current_measurement < CURRENT_CONSOMPTION_SLEEP_MODE_LOW_THRESHOLD:
             self.press_push_in_button()
             sleep(0.5)
             return True
@@ -288,9 +335,10 @@ class Bms3Sequencer():
 
     # Disable all relays
     def disable_all_relays(self):
-        for relay in self._relay_list:
-            if relay['state'] == State.Enable:
-                self._desactivate_relay(relay)
+        with self._control_relay.batch():
+            for relay in self._relay_list:
+                if relay['state'] == State.Enable:
+                    self._desactivate_relay(relay)
 
     ###################
     # Private methods #
@@ -353,6 +401,7 @@ class Bms3Sequencer():
             # Exit prog
             self._tenma_dc_power_off()
             self.disable_all_relays()
+            self._tenma_dc_latency_report()
             exit()
 
         finally:
@@ -382,9 +431,7 @@ class Bms3Sequencer():
         self.activate_bms3_battery_measurement()
 
         # BMS3 battery voltage measurement tests
-        for voltage in voltage_to_check:
-            self._tenma_dc_set_voltage(voltage, Item.BMS3)
-            sleep(1)
+        for _ in self._tenma_dc_sweep(voltage_to_check, Item.BMS3):
             test_report_status.append(
                 self._battery_voltage_measurement_check())
 
@@ -399,8 +446,21 @@ class Bms3Sequencer():
 
     def _battery_voltage_measurement_check(self) -> bool:
         # Get measurements
+        since = monotonic()
+        voltage_statistics = self._voltmeter.statistics(STATISTICS_WINDOW, since)
+        voltage_measurement = self._settled_mean(
+            voltage_statistics,
+            self._voltmeter.wait_stable(
+                VOLTAGE_SETTLE_TOLERANCE,
+                SETTLE_SAMPLES,
+                timeout=1,
+                since=since).measurement)
+        # The BMS3 measurement settles on its own: wait for it
+        # since the step, meanwhile the voltmeter above
+        remaining = since + BMS3_VOLTAGE_SETTLE_TIME - monotonic()
+        if remaining > 0:
+            sleep(remaining)
         bms3_voltage_measurement = self._get_bms3_voltage_measurement()
-        voltage_measurement = self._voltmeter.get_measurement()
 
         # Set voltage threshold
         measurement_high_threshold = voltage_measurement + VOLTAGE_MEASUREMENT_HIGH_THRESHOLD
@@ -515,10 +575,24 @@ class Bms3Sequencer():
             voltage_high_threshold: int,
             current_low_threshold: int,
             current_high_threshold: int) -> list:
-        # Get measurements
-        sleep(1)
-        v_out_measurement = self._voltmeter.get_measurement()
-        current_measurement = self._ampmeter.get_measurement()
+        # Get measurements, once settled
+        since = monotonic()
+        v_out_statistics = self._voltmeter.statistics(STATISTICS_WINDOW, since)
+        current_statistics = self._ampmeter.statistics(STATISTICS_WINDOW, since)
+        v_out_measurement = self._settled_mean(
+            v_out_statistics,
+            self._voltmeter.wait_stable(
+                max(1, (voltage_high_threshold - voltage_low_threshold) // SETTLE_RANGE_RATIO),
+                SETTLE_SAMPLES,
+                timeout=1,
+                since=since).measurement)
+        current_measurement = self._settled_mean(
+            current_statistics,
+            self._ampmeter.wait_stable(
+                max(1, (current_high_threshold - current_low_threshold) // SETTLE_RANGE_RATIO),
+                SETTLE_SAMPLES,
+                timeout=max(SETTLE_MIN_TIMEOUT, since + 1 - monotonic()),
+                since=since).measurement)
 
         # Add measurement values to test report
         self._test_report['Vout test']['voltage values'].append(
@@ -598,10 +672,14 @@ class Bms3Sequencer():
     def _current_consomption_in_sleep_mode_test(self):
         # Init test
         self._display_sentence_inside_frame('Current consomption in sleep mode test')
+        since = monotonic()
         self.activate_current_measurement_and_check_reset()
 
-        # Get measurement
-        current_measurement = self._ampmeter.get_measurement()
+        # Get measurement, from the readings of the wait above
+        current_statistics = self._ampmeter.statistics(STATISTICS_WINDOW, since)
+        current_measurement = self._settled_mean(
+            current_statistics,
+            self._ampmeter.get_measurement())
 
         # Add measurement values to test report
         self._test_report['Current consomption in sleep mode']['value'] = (
@@ -1138,7 +1216,7 @@ class Bms3Sequencer():
     # BMS3 interface
     def _load_firmware(self, firmware_label):
         self.connect_tenma_alim()
-        self._tenma_dc_set_voltage(3333, Item.BMS3)
+        self._tenma_dc_set_voltage(REPROG_BMS3_VOLTAGE, Item.BMS3)
         self._tenma_dc_power_on()
         self.connect_reprog()
         self.press_push_in_button()
@@ -1150,7 +1228,7 @@ class Bms3Sequencer():
 
     def _load_firmware_with_st_link_utility(self):
         self.connect_tenma_alim()
-        self._tenma_dc_set_voltage(3333, Item.BMS3)
+        self._tenma_dc_set_voltage(REPROG_BMS3_VOLTAGE, Item.BMS3)
         self._tenma_dc_power_on()
         self.connect_reprog()
         self.press_push_in_button()
@@ -1244,11 +1322,18 @@ class Bms3Sequencer():
         if not current_measurement_connected:
             self.activate_current_measurement()
         # Check if push_in in automatic mode worked
+        since = monotonic()
         self._activate_relay(self._relay_push_in)
-        sleep(2)
-        current_measurement = self._ampmeter.get_measurement()
+        # Wake up: a reading taken after the push above the sleep threshold
+        woken_up = self._ampmeter.wait_until(
+            lambda: (
+                self._ampmeter.get_measurement_after(since) is not None
+                and
+                self._ampmeter.get_measurement()
+                > CURRENT_CONSOMPTION_SLEEP_MODE_LOW_THRESHOLD),
+            timeout=2)
         self._desactivate_relay(self._relay_push_in)
-        if current_measurement > CURRENT_CONSOMPTION_SLEEP_MODE_LOW_THRESHOLD:
+        if woken_up:
             self._push_in_state = PushInState.Automatic
         else:
             self._push_in_state = PushInState.Manual
@@ -1278,6 +1363,7 @@ class Bms3Sequencer():
                   '(Appuyer sur la touche ENTER)')
             self._tenma_dc_power_off()
             self.disable_all_relays()
+            self._tenma_dc_latency_report()
             exit()
         else:
             if not self._check_bms3_number_format(board_number):
@@ -1338,15 +1424,12 @@ class Bms3Sequencer():
         frame = '*' * 56
         frame = '\n\t' + frame
         # Seek for Voltmeter and Ampmeter
-        bcdDevices = self._get_bcd_devices()
-        for bcdDevice in bcdDevices:
-            tenma_multimeter = Tenma_72_7730A_manage(bcdDevice)
-            tenma_multimeter.start()
-            sleep(1)
-            if tenma_multimeter.get_mode() == 'Current':
-                self._ampmeter = tenma_multimeter
-            elif tenma_multimeter.get_mode() == 'Voltage':
-                self._voltmeter = tenma_multimeter
+        multimeters = discover_multimeters(
+            get_bcd_devices(ID_VENDOR, ID_PRODUCT),
+            record_folder=MULTIMETER_RECORDING_FOLDER,
+            serial_ports=MULTIMETER_SERIAL_PORTS)
+        self._ampmeter = multimeters.get('Current')
+        self._voltmeter = multimeters.get('Voltage')
         # Check if Ampmeter is well_connected
         if self._ampmeter is None:
             well_connected = False
@@ -1372,20 +1455,16 @@ class Bms3Sequencer():
             system('pause')
             exit()
 
-    def _get_bcd_devices(self) -> list[int]:
-        # Seek for all connected device
-        devices = usb.core.find(find_all=True)
-        # Select all Tenma_72_2535
-        bcdDevices = []
-        for device in devices:
-            if (
-                    device.idProduct == ID_PRODUCT
-                    and
-                    device.idVendor == ID_VENDOR
-                    and
-                    device.bcdDevice not in bcdDevices):
-                bcdDevices.append(device.bcdDevice)
-        return bcdDevices
+    def _settled_mean(
+            self,
+            statistics: WindowStatistics,
+            measurement: int) -> int:
+        # Mean of the readings of the statistics window up to now,
+        # measurement if there is none
+        window = statistics.update()
+        if window.count == 0:
+            return measurement
+        return round(window.mean)
 
     # Tenma DC
     def _tenma_dc_power_on(self):
@@ -1399,13 +1478,34 @@ class Bms3Sequencer():
             self._tenma_dc_power.set_voltage(0)
             self._tenma_dc_power.power('OFF')
 
-    def _tenma_dc_set_voltage(self, value: int, item: Item) -> int:
+    def _tenma_dc_latency_report(self):
+        report = self._tenma_dc_power.latency_report()
+        if report is not None:
+            self._display_sentence_inside_frame('Tenma DC power latencies (ms)')
+            print('\t' + report.replace('\n', '\n\t'))
+            print()
+
+    def _tenma_dc_max_values(self, item: Item) -> tuple[int]:
         if item == Item.BMS3:
             max_voltage = MAX_BMS3_VOLTAGE
             max_current = MAX_BMS3_CURRENT
         else:
             max_voltage = MAX_USB_VOLTAGE
             max_current = MAX_USB_CURRENT
+        return max_voltage, max_current
+
+    def _tenma_dc_set_voltage(self, value: int, item: Item) -> int:
+        max_voltage, max_current = self._tenma_dc_max_values(item)
         value = min(max_voltage, value)
+        # Use a single recall if this operating point is in memory
+        slot = self._tenma_dc_power.get_preset_slot(value, max_current)
+        if slot is not None:
+            return self._tenma_dc_power.recall_preset(slot).voltage
         self._tenma_dc_power.set_current(max_current)
         return self._tenma_dc_power.set_voltage(value)
+
+    def _tenma_dc_sweep(self, values: list[int], item: Item, **kwargs):
+        max_voltage, max_current = self._tenma_dc_max_values(item)
+        values = [min(max_voltage, value) for value in values]
+        self._tenma_dc_power.set_current(max_current)
+        return self._tenma_dc_power.sweep(values, **kwargs)
@@ -1 +1,7 @@
+import serial
+
 from .tenmaDcLib import *
+
+# Open "tenma://" URLs on the supply emulator (see protocol_tenma.py)
+if __name__ not in serial.protocol_handler_packages:
+    serial.protocol_handler_packages.append(__name__)
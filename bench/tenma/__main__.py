@@ -15,50 +15,130 @@ if "-dc_power" in argv:
 
 
 if "-multimeter" in argv:
-    from .tenma_multimeter import Tenma_72_7730A_manage
+    from .multimeter_discovery import get_bcd_devices, discover_multimeters
     from time import sleep
-    import usb.core
     from bench.sequencer.sequencer import ID_PRODUCT, ID_VENDOR
-    
-    
-    def get_bcd_devices() -> list[int]:
-        # Seek for all connected device
-        devices = usb.core.find(find_all=True)
-        # with open('usb_devices', 'w') as f:
-        #     for d in devices:
-        #         f.write(d._str())
-        #         f.write('\n')
-        # Select all Tenma_72_2535
-        bcdDevices = []
-        for device in devices:
-            if (
-                    device.idProduct == ID_PRODUCT
-                    and
-                    device.idVendor == ID_VENDOR
-                    and
-                    device.bcdDevice not in bcdDevices):
-                bcdDevices.append(device.bcdDevice)
-        return bcdDevices
-
-    
-    # Intialization
-    ampmeter = None
-    voltmeter = None
-    well_connected = True
-    frame = '*' * 56
-    frame = '\n\t' + frame
+
     # Seek for Voltmeter and Ampmeter
-    bcdDevices = get_bcd_devices()
-    for bcdDevice in bcdDevices:
-        tenma_multimeter = Tenma_72_7730A_manage(bcdDevice)
-        tenma_multimeter.start()
-        sleep(1)
-        if tenma_multimeter.get_mode() == 'Current':
-            ampmeter = tenma_multimeter
-        elif tenma_multimeter.get_mode() == 'Voltage':
-            voltmeter = tenma_multimeter
+    multimeters = discover_multimeters(get_bcd_devices(ID_VENDOR, ID_PRODUCT))
+    ampmeter = multimeters.get('Current')
+    voltmeter = multimeters.get('Voltage')
     for _ in range(10):
         print()
         print(f'\tampmeter : {ampmeter.get_measurement()}')
         print(f'\tvoltmeter : {voltmeter.get_measurement()}')
         sleep(.4)
+
+
+if "-emulator" in argv:
+    # Time a command sequence against the supply emulator (no hardware)
+    from time import monotonic
+    from .tenmaDcLib import Tenma72_2535
+
+    url = 'tenma://72-2535?latency=0.01&load=33&min_gap=0.02'
+    modes = {
+        'fixed delay': {'fixedDelay': True},
+        'response driven': {},
+        'pipelined': {'pipelined': True}}
+    for mode, options in modes.items():
+        tenma = Tenma72_2535(url, **options)
+        if options.get('pipelined'):
+            tenma.learnCommandGap()
+        start = monotonic()
+        for voltage in range(1000, 5000, 500):
+            tenma.setCurrent(1, 200)
+            tenma.setVoltage(1, voltage)
+            tenma.runningVoltage(1)
+            tenma.runningCurrent(1)
+        tenma.readStatus()
+        elapsed = monotonic() - start
+        print(f'\t{mode:>16} : {elapsed:.3f} s')
+        tenma.close()
+
+
+if "-decode_benchmark" in argv:
+    # Frames/s of the multimeter HID parser and decoder (no hardware)
+    from array import array
+    from time import perf_counter
+    from .multimeter import MeasurementFunction
+    from .tenma_multimeter import HidFrameParser, decode_frame
+
+    def legacy_decode(frame):
+        # String and float decoder that decode_frame replaced,
+        # kept as the reference of the benchmark
+        digits = frame[0:5]
+        s = ''
+        overflow = max(digits) > 10
+        if not overflow:
+            for digit in digits:
+                if digit < 10:
+                    s += str(digit)
+        range_value = frame[5]
+        mode_value = frame[6]
+        decimal = 0
+        mul = 1
+        if mode_value == MeasurementFunction.Voltage.value:
+            mode = MeasurementFunction.Voltage
+            decimal = range_value
+        elif mode_value in (
+                MeasurementFunction.Current.value,
+                MeasurementFunction.Resistance.value):
+            mode = MeasurementFunction(mode_value)
+            decimal = (range_value + 1) % 3 + 1
+            mul = 1000**((range_value + 1) // 3)
+        else:
+            mode = MeasurementFunction.UnImplemented
+        value = 0 if overflow else float(s[:decimal] + '.' + s[decimal:])
+        if frame[8] & 0b100:
+            value *= -1
+        value *= mul
+        return mode, int(value * 1000)
+
+    # 0.3301 V, 1.234 mA, -1.2345 kOhm
+    frames = [
+        bytes([0, 3, 3, 0, 1, 1, 1, 0, 0, 0, 0]),
+        bytes([0, 1, 2, 3, 4, 0, 8, 0, 0, 0, 0]),
+        bytes([1, 2, 3, 4, 5, 2, 4, 0, 4, 0, 0])]
+    count = 300_000
+    for name, decode in (
+            ('decode (legacy)', legacy_decode),
+            ('decode', decode_frame)):
+        start = perf_counter()
+        for index in range(count):
+            decode(frames[index % len(frames)])
+        elapsed = perf_counter() - start
+        print(f'\t{name:>16} : {count / elapsed:,.0f} frames/s')
+
+    # One HID report per nibble, as the multimeter sends them
+    reports = [
+        array('B', [0xF1, 0x30 | nibble])
+        for frame in frames
+        for nibble in list(frame) + [13, 10]]
+    for name, decode in (
+            ('parse + legacy', legacy_decode),
+            ('parse + decode', decode_frame)):
+        parser = HidFrameParser(decode)
+        start = perf_counter()
+        for _ in range(count // len(frames)):
+            for report in reports:
+                parser.feed(report)
+        elapsed = perf_counter() - start
+        print(f'\t{name:>16} : {count / elapsed:,.0f} frames/s')
+
+
+if "-replay" in argv:
+    # Replay a multimeter recording: -replay <path> [speed, default 0]
+    from time import perf_counter
+    from .tenma_multimeter import Tenma_72_7730A_replay
+
+    index = argv.index("-replay")
+    path = argv[index + 1]
+    speed = float(argv[index + 2]) if len(argv) > index + 2 else 0
+    replay = Tenma_72_7730A_replay(path, speed)
+    start = perf_counter()
+    replay.start()
+    replay.join()
+    elapsed = perf_counter() - start
+    count = replay.get_reading_count()
+    print(f'\t{count} readings in {elapsed:.3f} s')
+    print(f'\tLast reading : {replay.get_measurement()} ({replay.get_mode()})')
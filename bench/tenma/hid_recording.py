@@ -0,0 +1,95 @@
+'''
+hid_recording.py - raw HID report recordings of the TENMA 72-7730A
+multimeters.
+
+A recording is an append-only binary file:
+    MAGIC
+    then, for each report:
+        timestamp   float64, little endian, time.time() of the read
+        length      uint16, little endian
+        report      length bytes, as read from the USB endpoint
+
+HidRecorder appends the reports, one unbuffered write each, so a
+recording stays readable up to the last report if the bench stops.
+HidRecording maps a recording in memory and iterates over its reports
+without copying them.
+'''
+
+import mmap
+import os
+import struct
+from time import time, monotonic
+from typing import Iterator, Optional
+
+MAGIC = b'TNMAHID1'
+RECORD_HEADER = struct.Struct('<dH')
+
+
+class HidRecorder:
+
+    def __init__(self, path: str):
+        '''path: recording to create, or to append to'''
+
+        self._file = open(path, 'ab', buffering=0)
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+        # Timestamps follow time.monotonic(), from the wall clock at start
+        self._start_time = time()
+        self._start = monotonic()
+
+    def record(self, report, timestamp: Optional[float] = None):
+        '''Append a report read at timestamp (time.monotonic(), default: now).'''
+
+        if timestamp is None:
+            timestamp = monotonic()
+        self._file.write(
+            RECORD_HEADER.pack(
+                self._start_time + timestamp - self._start,
+                len(report))
+            + bytes(report))
+
+    def close(self):
+        self._file.close()
+
+
+class HidRecording:
+
+    def __init__(self, path: str):
+        '''path: recording to read'''
+
+        self._file = open(path, 'rb')
+        if os.fstat(self._file.fileno()).st_size < len(MAGIC):
+            self._file.close()
+            raise ValueError(f'{path} is not a multimeter recording')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f'{path} is not a multimeter recording')
+
+    def __iter__(self) -> Iterator[tuple[float, memoryview]]:
+        '''Yield (timestamp, report) for each report, in recording order.
+
+        report is a view of the mapped file: release() it, or drop it,
+        before close().'''
+
+        size = len(self._map)
+        offset = len(MAGIC)
+        with memoryview(self._map) as view:
+            while offset + RECORD_HEADER.size <= size:
+                timestamp, length = RECORD_HEADER.unpack_from(self._map, offset)
+                offset += RECORD_HEADER.size
+                if offset + length > size:
+                    # Last report cut by a crash
+                    break
+                yield timestamp, view[offset:offset + length]
+                offset += length
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
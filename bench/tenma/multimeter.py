@@ -0,0 +1,212 @@
+'''
+multimeter.py - transport independent part of the TENMA 72-7730A
+multimeter drivers.
+
+Multimeter is a thread reading the multimeter through one transport,
+which calls _store_reading() with each decoded reading:
+    Tenma_72_7730A_manage (tenma_multimeter.py): HID, supplied IR/USB cable
+    Tenma_72_7730A_serial (tenma_serial_multimeter.py): optical serial cable
+Both share the timestamped ring buffer of the readings, the waits,
+the settling and the statistics, so the bench uses them the same way.
+
+Readings are integers: MICRO_SCALE unit (µV, µA, µOhm)
+for get_measurement_micro(), mV, µA or mOhm for get_measurement().
+'''
+
+import threading
+from enum import Enum
+from time import monotonic
+from typing import Callable, NamedTuple, Optional, Union
+
+from ..utils.ring_buffer import RingBuffer, Sample
+from ..utils.window_statistics import WindowStatistics
+
+
+# Values are the mode nibble of the HID frames
+class MeasurementFunction(Enum):
+    Voltage = 1
+    Current = 8
+    Resistance = 4
+    UnImplemented = -1
+
+
+# Integer readings unit, per function: µV, µA, µOhm
+MICRO_SCALE = {
+    MeasurementFunction.Voltage: 1_000_000,         # Displayed in V
+    MeasurementFunction.Current: 1_000,             # Displayed in mA
+    MeasurementFunction.Resistance: 1_000_000,      # Displayed in Ohm
+    MeasurementFunction.UnImplemented: 1_000_000}
+# get_measurement() unit, per function: mV, µA, mOhm
+MEASUREMENT_DIVISOR = {
+    MeasurementFunction.Voltage: 1000,
+    MeasurementFunction.Current: 1,
+    MeasurementFunction.Resistance: 1000,
+    MeasurementFunction.UnImplemented: 1000}
+
+
+class Settling(NamedTuple):
+    measurement: int        # Last reading, as get_measurement()
+    settle_time: float      # Time to get it (s)
+    stable: bool            # False if the readings didn't converge in time
+
+
+class Multimeter(threading.Thread):
+
+    def __init__(self, buffer_size: int = 1024):
+        '''
+        buffer_size: number of readings kept
+        '''
+        threading.Thread.__init__(self, daemon=True)
+        # Last reading, in MICRO_SCALE unit and as get_measurement()
+        self._measurement_micro = 0
+        self._measurement = 0
+        # Readings (as get_measurement()), stamped when they were received
+        self._readings = RingBuffer(buffer_size)
+        # Notified at each new reading
+        self._condition = threading.Condition()
+        self._mode = None
+        self._thread_run = True
+
+    def stop(self):
+        '''Stop the reader thread, once its current read is done.'''
+
+        self._thread_run = False
+
+    def get_measurement(self) -> int:
+        return self._measurement
+
+    def get_measurement_micro(self) -> int:
+        '''Last reading in µV, µA or µOhm.'''
+
+        return self._measurement_micro
+
+    def get_measurement_after(self, timestamp: float) -> Optional[Sample]:
+        '''Return the first reading taken at timestamp
+        (time.monotonic()) or later, None if there is none yet.'''
+
+        return self._readings.first_since(timestamp)
+
+    def window(self, ms: float) -> list[Sample]:
+        '''Return the readings of the last ms milliseconds, oldest first.'''
+
+        return self._readings.since(monotonic() - ms / 1000)
+
+    def get_reading_count(self) -> int:
+        '''Number of readings since the start, i.e. the sequence number
+        of the next one.'''
+
+        return self._readings.count()
+
+    def count_since(self, seq: int) -> int:
+        '''Number of readings numbered seq or more.'''
+
+        return max(0, self._readings.count() - seq)
+
+    def statistics(
+            self,
+            duration: Optional[float] = None,
+            since: Optional[float] = None) -> WindowStatistics:
+        '''Return the statistics of the readings of the last duration (s),
+        taken after since (time.monotonic()), updated by their update().'''
+
+        return WindowStatistics(self._readings, duration, since)
+
+    def wait_stable(
+            self,
+            tolerance: int,
+            n_samples: int = 3,
+            timeout: float = 5,
+            since: Optional[float] = None) -> Settling:
+        '''Wait until n_samples consecutive readings, all taken after since
+        (time.monotonic(), default: now), stay within tolerance
+        (unit of get_measurement()).
+
+        If timeout (s) expires before, return the last reading anyway,
+        with stable False.'''
+
+        if since is None:
+            since = monotonic()
+        readings = []
+
+        def settled() -> bool:
+            nonlocal readings
+            readings = self._readings.since(since)[-n_samples:]
+            values = [reading.value for reading in readings]
+            return (
+                len(values) == n_samples
+                and
+                max(values) - min(values) <= tolerance)
+
+        if self.wait_until(settled, timeout):
+            return Settling(
+                readings[-1].value,
+                readings[-1].timestamp - since,
+                True)
+        return Settling(self.get_measurement(), monotonic() - since, False)
+
+    def wait_until(
+            self,
+            predicate: Callable[[], bool],
+            timeout: Optional[float] = None) -> bool:
+        '''Wait until predicate() is true, checking it now
+        and at each new reading.
+
+        Return False if timeout (s) expired before.'''
+
+        with self._condition:
+            return bool(self._condition.wait_for(predicate, timeout))
+
+    def wait_for_next_reading(
+            self,
+            timeout: Optional[float] = None) -> Optional[Sample]:
+        '''Wait for a reading decoded after this call and return it,
+        None if timeout (s) expired before.'''
+
+        with self._condition:
+            count = self._readings.count()
+            if self._condition.wait_for(
+                    lambda: self._readings.count() > count,
+                    timeout):
+                return self._readings.latest()
+            return None
+
+    def wait_for_mode(
+            self,
+            mode: Union[str, MeasurementFunction],
+            timeout: Optional[float] = None) -> bool:
+        '''Wait until the multimeter reports mode
+        (a MeasurementFunction or its name, e.g. 'Voltage').
+
+        Return False if timeout (s) expired before.'''
+
+        if isinstance(mode, MeasurementFunction):
+            mode = mode.name
+        return self.wait_until(lambda: self.get_mode() == mode, timeout)
+
+    def get_mode(self) -> str:
+        if self._mode is None:
+            return ''
+        else:
+            return self._mode.name
+
+    def _store_reading(
+            self,
+            function: MeasurementFunction,
+            micro: int,
+            timestamp: float):
+        '''Store a reading in MICRO_SCALE unit, received at timestamp
+        (time.monotonic()), and wake up the waits.'''
+
+        # Truncated toward zero, as int()
+        divisor = MEASUREMENT_DIVISOR[function]
+        if micro < 0:
+            measurement = -(-micro // divisor)
+        else:
+            measurement = micro // divisor
+
+        with self._condition:
+            self._mode = function
+            self._measurement_micro = micro
+            self._measurement = measurement
+            self._readings.append(timestamp, measurement)
+            self._condition.notify_all()
@@ -0,0 +1,114 @@
+'''
+multimeter_discovery.py - find the connected TENMA 72-7730A multimeters
+and identify each of them by its measurement mode.
+
+All the multimeters are opened and started at the same time, and
+discover_multimeters() returns as soon as each one has sent its first
+reading, so the discovery lasts as long as the slowest multimeter,
+whatever their number:
+
+    roles = discover_multimeters(get_bcd_devices(ID_VENDOR, ID_PRODUCT))
+    ampmeter = roles.get('Current')
+    voltmeter = roles.get('Voltage')
+
+Multimeters on optical serial cables are opened from their ports:
+
+    roles = discover_multimeters([], serial_ports=['COM3', 'COM4'])
+
+With async_usb=True (python-libusb1 required), the multimeters are read
+by a single UsbAsyncReader event thread, whatever their number.
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from os.path import join as os_path_join
+from time import monotonic
+from typing import Optional
+
+import usb.core
+
+from .multimeter import Multimeter
+from .tenma_multimeter import Tenma_72_7730A_manage
+from .tenma_serial_multimeter import Tenma_72_7730A_serial
+from .usb_async_reader import UsbAsyncReader
+
+
+def get_bcd_devices(id_vendor: int, id_product: int) -> list[int]:
+    '''Return the bcdDevice of each connected id_vendor:id_product device.'''
+
+    # Seek for all connected device
+    devices = usb.core.find(find_all=True)
+    # Select all multimeters
+    bcd_devices = []
+    for device in devices:
+        if (
+                device.idProduct == id_product
+                and
+                device.idVendor == id_vendor
+                and
+                device.bcdDevice not in bcd_devices):
+            bcd_devices.append(device.bcdDevice)
+    return bcd_devices
+
+
+def discover_multimeters(
+        bcd_devices: list[int],
+        timeout: float = 1,
+        record_folder: Optional[str] = None,
+        async_usb: bool = False,
+        serial_ports: Optional[list[str]] = None) -> dict[str, Multimeter]:
+    '''Open and start the multimeters of bcd_devices concurrently,
+    and those on the optical serial cables of serial_ports.
+
+    With record_folder, the raw HID reports of each multimeter are
+    recorded in record_folder/multimeter_<bcdDevice>_<YYYY-mm-dd_HH-MM-SS>.hidrec,
+    one file per discovery.
+    With async_usb, a single UsbAsyncReader reads all the multimeters,
+    otherwise each one has its own reader thread.
+
+    Return the role map {mode: multimeter}, mode being the name
+    of the MeasurementFunction of the first reading ('Voltage', 'Current',
+    'Resistance'...). A multimeter without any reading within timeout (s),
+    e.g. whose SEND function is off, or reporting the mode of another one,
+    is stopped and left out.'''
+
+    roles = {}
+    serial_ports = serial_ports or []
+    if not bcd_devices and not serial_ports:
+        return roles
+    session = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+    usb_reader = None
+    if async_usb and bcd_devices:
+        usb_reader = UsbAsyncReader()
+        usb_reader.start()
+
+    def open_multimeter(bcd_device: int) -> Tenma_72_7730A_manage:
+        record_path = None
+        if record_folder is not None:
+            record_path = os_path_join(
+                record_folder,
+                f'multimeter_{bcd_device:04x}_{session}.hidrec')
+        return Tenma_72_7730A_manage(
+            bcd_device,
+            record_path=record_path,
+            usb_reader=usb_reader)
+
+    # Open all the multimeters at once
+    with ThreadPoolExecutor(
+            max_workers=len(bcd_devices) + len(serial_ports)) as executor:
+        hid_multimeters = executor.map(open_multimeter, bcd_devices)
+        serial_multimeters = executor.map(Tenma_72_7730A_serial, serial_ports)
+        multimeters = list(hid_multimeters) + list(serial_multimeters)
+    for multimeter in multimeters:
+        multimeter.start()
+    # They all run meanwhile: the wait lasts as long as the slowest one
+    deadline = monotonic() + timeout
+    for multimeter in multimeters:
+        has_reading = multimeter.wait_until(
+            lambda multimeter=multimeter: multimeter.get_reading_count() > 0,
+            max(0, deadline - monotonic()))
+        if has_reading and multimeter.get_mode() not in roles:
+            roles[multimeter.get_mode()] = multimeter
+        else:
+            multimeter.stop()
+    return roles
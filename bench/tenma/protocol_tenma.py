@@ -0,0 +1,139 @@
+'''
+protocol_tenma.py - pyserial handler of the "tenma://" URLs.
+
+It opens a TenmaEmulator instead of a serial port:
+
+    tenma://[model][?latency=<s>&load=<Ohm>&min_gap=<s>]
+
+    tenma://72-2535?latency=0.01&load=33&min_gap=0.02
+
+The handler is registered by the bench.tenma package,
+so any serial.serial_for_url() call accepts these URLs.
+'''
+
+from time import sleep, monotonic
+import urllib.parse as urlparse
+
+from serial.serialutil import SerialBase, SerialException, PortNotOpenError
+
+from .tenma_emulator import TenmaEmulator
+
+
+class Serial(SerialBase):
+
+    def open(self):
+        if self.is_open:
+            raise SerialException("Port is already open.")
+        if self._port is None:
+            raise SerialException("Port must be configured before it can be used.")
+        self.emulator = TenmaEmulator(**self.from_url(self.port))
+        self.is_open = True
+
+    def close(self):
+        '''Drop the emulator, with its pending replies.'''
+
+        if self.is_open:
+            self.emulator.reset()
+            self.emulator = None
+            self.is_open = False
+
+    def from_url(self, url: str) -> dict:
+        '''Return the TenmaEmulator parameters of url.'''
+
+        parts = urlparse.urlsplit(url)
+        if parts.scheme != 'tenma':
+            raise SerialException(
+                'expected a string in the form '
+                '"tenma://[model][?latency=<s>&load=<Ohm>&min_gap=<s>]": '
+                f'not starting with tenma:// ({parts.scheme!r})')
+        parameters = {'baudrate': self._baudrate}
+        if parts.netloc:
+            parameters['model'] = parts.netloc
+        for option, values in urlparse.parse_qs(parts.query, True).items():
+            if option in ('latency', 'load', 'min_gap'):
+                parameters[option] = float(values[0])
+            else:
+                raise SerialException(f'unknown option: {option!r}')
+        return parameters
+
+    def _reconfigure_port(self):
+        # Nothing to configure on an emulator
+        pass
+
+    @property
+    def in_waiting(self) -> int:
+        if not self.is_open:
+            raise PortNotOpenError()
+        return self.emulator.in_waiting()
+
+    def read(self, size: int = 1) -> bytes:
+        '''Read size bytes, or less if the timeout expires.'''
+
+        if not self.is_open:
+            raise PortNotOpenError()
+        deadline = None if self._timeout is None else monotonic() + self._timeout
+        data = bytearray()
+        while len(data) < size:
+            data += self.emulator.read(size - len(data))
+            if len(data) == size:
+                break
+            now = monotonic()
+            if deadline is not None and now >= deadline:
+                break
+            next_byte_time = self.emulator.next_byte_time()
+            if next_byte_time is None:
+                # Nothing is coming
+                if deadline is None:
+                    break
+                wait = deadline - now
+            else:
+                wait = next_byte_time - now
+                if deadline is not None:
+                    wait = min(wait, deadline - now)
+            sleep(max(wait, 0))
+        return bytes(data)
+
+    def write(self, data) -> int:
+        if not self.is_open:
+            raise PortNotOpenError()
+        data = bytes(data)
+        self.emulator.write(data)
+        return len(data)
+
+    def reset_input_buffer(self):
+        if not self.is_open:
+            raise PortNotOpenError()
+        self.emulator.reset()
+
+    def reset_output_buffer(self):
+        if not self.is_open:
+            raise PortNotOpenError()
+
+    @property
+    def out_waiting(self) -> int:
+        return 0
+
+    def _update_break_state(self):
+        pass
+
+    def _update_rts_state(self):
+        pass
+
+    def _update_dtr_state(self):
+        pass
+
+    @property
+    def cts(self) -> bool:
+        return True
+
+    @property
+    def dsr(self) -> bool:
+        return True
+
+    @property
+    def ri(self) -> bool:
+        return False
+
+    @property
+    def cd(self) -> bool:
+        return True
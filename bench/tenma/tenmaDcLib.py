@@ -32,33 +32,277 @@
     they use the same serial protocol.
 """
 
+import concurrent.futures
+import json
+import os
 import serial
-from time import sleep
+import serial.tools.list_ports
+import threading
+from enum import Enum
+from time import sleep, monotonic
+
+from .tenma_pipeline import TenmaPipeline, command_type
+
+from ..utils.latency_histogram import LatencyRecorder
+from ..utils.utils import get_port_identifier
+
+#: Default file of the model detection cache
+DETECTION_CACHE_FILE = os.path.join(os.path.dirname(__file__), ".tenma_detection_cache.json")
 
 
 class TenmaException(Exception):
     pass
 
 
-def instantiate_tenma_class_from_device_response(device, debug=False):
+class VerifyPolicy(Enum):
+    """
+        When setVoltage/setCurrent read back the programmed setpoint
+    """
+    #: After every set
+    Always = 'Always'
+    #: Never, trust the unit
+    Never = 'Never'
+    #: On demand, for all pending sets, with verifySetpoints()
+    Deferred = 'Deferred'
+    #: Only after the first set of each setpoint
+    FirstSet = 'FirstSet'
+
+
+class TenmaDetectionCache(object):
+    """
+        Detected models, stored on disk and keyed by the USB serial number
+        of the unit, or by its USB location when units of the same
+        VID:PID share their serial number (see get_port_identifier())
+
+        Each entry holds the *IDN? string and the name of the detected class.
+        Several caches may use the same file, from several threads: each
+        change is merged into the file as it is on disk, then written
+        to a temporary file renamed over it.
+    """
+
+    #: Serialize the changes of the caches of this process
+    _fileLock = threading.Lock()
+
+    def __init__(self, path=DETECTION_CACHE_FILE):
+        self.path = path
+        self._entries = self._load()
+
+    @staticmethod
+    def key(device):
+        """
+            Cache key of the unit on serial port device, None if unknown
+        """
+        ports = serial.tools.list_ports.comports()
+        for port in ports:
+            if port.device == device:
+                if port.vid is None:
+                    return None
+                return get_port_identifier(
+                    port,
+                    [other for other in ports
+                     if (other.vid, other.pid) == (port.vid, port.pid)])
+        return None
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def store(self, key, idn, model):
+        self._update(key, {"idn": idn, "model": model})
+
+    def invalidate(self, key):
+        self._update(key, None)
+
+    def check(self, key, idn):
+        """
+            Invalidate the entry of key if the unit now answers another idn
+        """
+        entry = self.get(key)
+        if entry is not None and entry["idn"] != idn:
+            print("Tenma unit {key} changed, its detected model is invalidated".format(key=key))
+            self.invalidate(key)
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _update(self, key, entry):
+        """
+            Set the entry of key, or remove it if entry is None,
+            keeping the entries stored in the meantime by other caches
+        """
+        with self._fileLock:
+            entries = self._load()
+            self._entries = entries
+            if entry is None:
+                if entries.pop(key, None) is None:
+                    return
+            else:
+                entries[key] = entry
+            temporary = "{path}.{pid}.tmp".format(path=self.path, pid=os.getpid())
+            with open(temporary, "w", encoding="utf8") as f:
+                json.dump(entries, f, indent=4)
+            os.replace(temporary, self.path)
+
+
+class TenmaStatus(object):
+    """
+        Decoded STATUS? byte, as an int bitfield
+
+        The STATUS? byte does not report OCP and OVP, their flags are
+        stored above it, as last set with setOCP()/setOVP().
+    """
+    __slots__ = ("value",)
+
+    #: STATUS? bits
+    CH1_CV = 0x01
+    CH2_CV = 0x02
+    TRACKING = 0x0C
+    BEEP = 0x10
+    LOCK = 0x20
+    OUTPUT = 0x40
+    #: Flags tracked by the driver
+    OCP = 0x100
+    OVP = 0x200
+
+    TRACKING_NAMES = {
+        0: "Independent",
+        1: "Tracking Series",
+        3: "Tracking Parallel",
+    }
+
+    def __init__(self, value):
+        self.value = value
+
+    @property
+    def ch1ConstantVoltage(self):
+        return bool(self.value & self.CH1_CV)
+
+    @property
+    def ch1ConstantCurrent(self):
+        return not self.value & self.CH1_CV
+
+    @property
+    def ch2ConstantVoltage(self):
+        return bool(self.value & self.CH2_CV)
+
+    @property
+    def ch2ConstantCurrent(self):
+        return not self.value & self.CH2_CV
+
+    @property
+    def ch1Mode(self):
+        return "C.V" if self.value & self.CH1_CV else "C.C"
+
+    @property
+    def ch2Mode(self):
+        return "C.V" if self.value & self.CH2_CV else "C.C"
+
+    @property
+    def tracking(self):
+        return self.TRACKING_NAMES.get((self.value & self.TRACKING) >> 2, "Unknown")
+
+    @property
+    def beepEnabled(self):
+        return bool(self.value & self.BEEP)
+
+    @property
+    def lockEnabled(self):
+        return bool(self.value & self.LOCK)
+
+    @property
+    def outEnabled(self):
+        return bool(self.value & self.OUTPUT)
+
+    @property
+    def ocpEnabled(self):
+        return bool(self.value & self.OCP)
+
+    @property
+    def ovpEnabled(self):
+        return bool(self.value & self.OVP)
+
+    def asDict(self):
+        """
+            Status as returned by Tenma72Base.getStatus()
+        """
+        return {
+            "ch1Mode": self.ch1Mode,
+            "ch2Mode": self.ch2Mode,
+            "Tracking": self.tracking,
+            "BeepEnabled": self.beepEnabled,
+            "lockEnabled": self.lockEnabled,
+            "outEnabled": self.outEnabled
+        }
+
+    def __eq__(self, other):
+        return isinstance(other, TenmaStatus) and self.value == other.value
+
+    def __hash__(self):
+        return hash(self.value)
+
+    def __repr__(self):
+        return "TenmaStatus(0x{:03x})".format(self.value)
+
+
+def instantiate_tenma_class_from_device_response(device, debug=False, useCache=True,
+                                                 cachePath=DETECTION_CACHE_FILE,
+                                                 fallbackModel=None, **kwargs):
     """
         Get a proper Tenma subclass depending on the version
         response from the unit.
 
         The subclasses mainly deal with the limit checks for each
         unit.
+
+        With useCache, the detected model is stored in cachePath and
+        reused on the next calls for the same unit, skipping the *IDN?
+        probe and the port reopen. The cached model is trusted until
+        the unit fails a setpoint read-back or a getVersion() returns
+        another *IDN? string: the entry is then invalidated, and the
+        model detected again on the next call.
+
+        fallbackModel is the class used when the *IDN? string matches
+        no model (default: Tenma72_2545).
+
+        kwargs are passed to the subclass constructor (fixedDelay,
+        verifyPolicy, pipelined...).
     """
+    if fallbackModel is None:
+        fallbackModel = Tenma72_2545
+    models = {cls.__name__: cls for cls in Tenma72Base.__subclasses__()}
+    cache = TenmaDetectionCache(cachePath) if useCache else None
+    key = TenmaDetectionCache.key(device) if useCache else None
+
+    if key is not None:
+        entry = cache.get(key)
+        if entry is not None and entry["model"] in models:
+            T = models[entry["model"]](device, debug, **kwargs)
+            T.setDetectionCache(cache, key)
+            return T
+
     # Fist instantiate base to retrieve version
     T = Tenma72Base(device, debug=debug)
-    ver = T.getVersion()
-    T.close()
-    
+    try:
+        ver = T.getVersion()
+    finally:
+        T.close()
+
     for cls in Tenma72Base.__subclasses__():
         if cls.MATCH_STR in ver:
-            return cls(device, debug)
-
-    print("Could not detect Tenma Model, assuming 72_2545")
-    return Tenma72_2545(device, debug)
+            break
+    else:
+        print("Could not detect Tenma Model, assuming {model}".format(
+            model=fallbackModel.__name__))
+        cls = fallbackModel
+
+    T = cls(device, debug, **kwargs)
+    if key is not None:
+        cache.store(key, ver, cls.__name__)
+        T.setDetectionCache(cache, key)
+    return T
 
 class Tenma72Base(object):
     """
@@ -76,65 +320,426 @@ class Tenma72Base(object):
     MAX_MA = 5000
     MAX_MV = 30000
 
-
-    def __init__(self, serialPort, debug=False):
-        self.ser = serial.Serial(port=serialPort,
-                                 baudrate=9600,
-                                 parity=serial.PARITY_NONE,
-                                 stopbits=serial.STOPBITS_ONE)
+    # Transport timings (seconds).
+    #: Maximum wait for the first byte of a reply
+    RESPONSE_TIMEOUT = 0.5
+    #: Line silence after which a reply of unknown length is complete
+    INTER_BYTE_TIMEOUT = 0.02
+    #: Minimum delay between two commands, the unit drops commands sent too close
+    COMMAND_GAP = 0.05
+    #: Safety factor applied to the command gap measured by learnCommandGap()
+    GAP_MARGIN = 1.25
+    #: Polling period of the input buffer while waiting for a reply
+    POLL_INTERVAL = 0.001
+    #: Delay applied after every command in fixed delay mode
+    FIXED_DELAY = 0.2
+    #: Maximum wait for the reply of a query in pipelined mode,
+    #: queued commands included
+    PIPELINE_TIMEOUT = 5
+
+    #: Reply length (bytes) of each query, None when framed on line silence
+    RESPONSE_LENGTH = {
+        "STATUS": 1,
+        "VSET": 5,
+        "ISET": 5,
+        "VOUT": 5,
+        "IOUT": 5,
+        "*IDN": None,
+    }
+    #: Numeric replies are made of at most 5 characters
+    VALUE_LENGTH = 5
+    #: Size of the receive buffer, larger than any reply
+    RX_BUFFER_SIZE = 64
+
+    def __init__(self, serialPort, debug=False, fixedDelay=False,
+                 verifyPolicy=VerifyPolicy.Always, pipelined=False, maxInFlight=4):
+        """
+            :param serialPort: Serial port of the unit
+            :param debug: Print the serial traffic
+            :param fixedDelay: Use the legacy transport, which sleeps
+                FIXED_DELAY after every command instead of waiting for the reply
+            :param verifyPolicy: When setVoltage/setCurrent read back the setpoint
+            :param pipelined: Send the commands from an I/O thread, see startPipeline()
+            :param maxInFlight: Maximum number of queries waiting for their reply
+                in pipelined mode
+        """
+        if fixedDelay and pipelined:
+            raise TenmaException("The fixed delay transport can't be pipelined")
+        # Serialize the command/reply exchanges of concurrent threads
+        self._lock = threading.RLock()
+        self.setPort(serialPort)
 
         self.DEBUG = debug
+        self.fixedDelay = fixedDelay
+        self.verifyPolicy = verifyPolicy
+        self._lastCommandTime = 0
+        # Delay between two commands, see learnCommandGap()
+        self.commandGap = self.COMMAND_GAP
+        self._pipeline = None
+        # Latency of each command, see recordLatency()
+        self.latencyRecorder = None
+        self._firstByteTime = None
+        # Setpoints known to be programmed, {("V" | "I", channel): mV | mA}
+        self._setpoints = {}
+        # Setpoints read back at least once
+        self._verified = set()
+        # Sets waiting for verifySetpoints(), {("V" | "I", channel): command}
+        self._pendingVerify = {}
+        # Reusable receive buffer, avoid an allocation per reply
+        self._rxBuffer = bytearray(self.RX_BUFFER_SIZE)
+        self._rxView = memoryview(self._rxBuffer)
+        # Last status read, stale once a setting command has been sent
+        self._status = None
+        self._statusTime = 0
+        self._statusStale = True
+        # OCP/OVP as last set, the status byte does not report them
+        self._protectionFlags = 0
+        # Detection cache entry this instance comes from
+        self._detectionCache = None
+        self._detectionKey = None
+        if pipelined:
+            self.startPipeline(maxInFlight)
+
+    def setDetectionCache(self, cache, key):
+        """
+            Check the detection cache entry key on each getVersion(),
+            and invalidate it when a setpoint read-back fails
+        """
+        self._detectionCache = cache
+        self._detectionKey = key
 
     def setPort(self, serialPort):
-        self.ser = serial.Serial(port=serialPort,
-                                 baudrate=9600,
-                                 parity=serial.PARITY_NONE,
-                                 stopbits=serial.STOPBITS_ONE)
+        self.invalidateSetpoints()
+        # serial_for_url also opens pyserial URLs, e.g. an emulator
+        self.ser = serial.serial_for_url(serialPort,
+                                         baudrate=9600,
+                                         parity=serial.PARITY_NONE,
+                                         stopbits=serial.STOPBITS_ONE)
+
+    def startPipeline(self, maxInFlight=4):
+        """
+            Switch to the pipelined transport: the commands are sent from an
+            I/O thread, setting commands return without waiting, and queries
+            are sent without waiting for the previous replies, up to
+            maxInFlight of them (see submitQuery()).
+        """
+        with self._lock:
+            if self._pipeline is not None:
+                self._pipeline.max_in_flight = maxInFlight
+                return
+            self._pipeline = TenmaPipeline(self.ser,
+                                           self.commandGap,
+                                           maxInFlight,
+                                           self.RESPONSE_TIMEOUT,
+                                           self.INTER_BYTE_TIMEOUT,
+                                           self.POLL_INTERVAL)
+            self._pipeline.recorder = self.latencyRecorder
+            self._pipeline.start()
+
+    def stopPipeline(self):
+        """
+            Switch back to the request/response transport, once the
+            queued commands are done
+        """
+        with self._lock:
+            if self._pipeline is None:
+                return
+            self._pipeline.stop()
+            self._pipeline = None
+            self._lastCommandTime = monotonic()
+
+    def nextCommandTime(self):
+        """
+            time.monotonic() from which the next command is sent without
+            waiting for the command gap (direct transport)
+        """
+        return self._lastCommandTime + self.commandGap
+
+    def flush(self, timeout=None):
+        """
+            Wait until the queued commands have been sent and answered
+            (pipelined mode), returns False if timeout expired before
+        """
+        if self._pipeline is None:
+            return True
+        return self._pipeline.flush(timeout)
+
+    def recordLatency(self, recorder=None):
+        """
+            Record the 'write', 'first_byte' and 'complete' latencies of every
+            command type in recorder (a new LatencyRecorder by default),
+            until recordLatency(False). Returns the recorder.
+        """
+        if recorder is None:
+            recorder = LatencyRecorder()
+        elif recorder is False:
+            recorder = None
+        with self._lock:
+            self.latencyRecorder = recorder
+            if self._pipeline is not None:
+                self._pipeline.recorder = recorder
+        return recorder
+
+    def learnCommandGap(self, channel=1, attempts=3, resolution=0.002):
+        """
+            Measure the shortest delay between two commands the unit still
+            processes, and use it (with GAP_MARGIN) instead of COMMAND_GAP.
+
+            Only queries are sent, the unit settings are left untouched.
+            Returns the new command gap.
+        """
+        with self._lock:
+            maxInFlight = None
+            if self._pipeline is not None:
+                maxInFlight = self._pipeline.max_in_flight
+                self.stopPipeline()
+
+            low, high = 0.0, self.COMMAND_GAP
+            while high - low > resolution:
+                gap = (low + high) / 2
+                if self.__probeCommandGap(gap, channel, attempts):
+                    high = gap
+                else:
+                    low = gap
+            self.commandGap = min(high * self.GAP_MARGIN, self.COMMAND_GAP)
+            if self.DEBUG:
+                print("Command gap: {:.1f} ms".format(self.commandGap * 1000))
+
+            if maxInFlight is not None:
+                self.startPipeline(maxInFlight)
+            return self.commandGap
+
+    def __probeCommandGap(self, gap, channel, attempts):
+        """
+            True if two queries sent gap apart are both answered,
+            attempts times in a row
+        """
+        first = "VSET{channel}?".format(channel=channel)
+        second = "ISET{channel}?".format(channel=channel)
+        expected = self.__responseLength(first) + self.__responseLength(second)
+        for _ in range(attempts):
+            # Start from an idle unit
+            idle = self._lastCommandTime + self.COMMAND_GAP - monotonic()
+            if idle > 0:
+                sleep(idle)
+            self.ser.reset_input_buffer()
+            self.ser.write(first.encode('ascii'))
+            sleep(gap)
+            self.ser.write(second.encode('ascii'))
+            self._lastCommandTime = monotonic()
+            deadline = self._lastCommandTime + self.RESPONSE_TIMEOUT
+            while self.ser.in_waiting < expected and monotonic() < deadline:
+                sleep(self.POLL_INTERVAL)
+            if self.ser.in_waiting < expected:
+                return False
+        self.ser.reset_input_buffer()
+        return True
 
     def __sendCommand(self, command):
-        if self.DEBUG:
-            print(">> ", command)
-        self.ser.write(command.encode('ascii'))
-        # Give it time to process
-        sleep(0.2)
+        with self._lock:
+            if self.DEBUG:
+                print(">> ", command)
+            if self._pipeline is not None:
+                if not command.endswith("?"):
+                    self._statusStale = True
+                self._pipeline.submit(command)
+                return
+            start = monotonic()
+            if self.fixedDelay:
+                self.ser.write(command.encode('ascii'))
+                self._lastCommandTime = monotonic()
+                self.__recordLatency(command, 'write', start)
+                if not command.endswith("?"):
+                    self._statusStale = True
+                # Give it time to process
+                sleep(self.FIXED_DELAY)
+                return
+
+            # Only wait if the previous command is too recent
+            gap = self._lastCommandTime + self.commandGap - start
+            if gap > 0:
+                sleep(gap)
+            # Discard any late byte of a previous reply
+            self.ser.reset_input_buffer()
+            self.ser.write(command.encode('ascii'))
+            self._lastCommandTime = monotonic()
+            self.__recordLatency(command, 'write', start)
+            if not command.endswith("?"):
+                # Any setting may change the status
+                self._statusStale = True
+
+    def __recordLatency(self, command, phase, start, end=None):
+        """
+            Record the latency of phase, from start to end (default: last write)
+        """
+        if self.latencyRecorder is None:
+            return
+        if end is None:
+            end = self._lastCommandTime
+        self.latencyRecorder.record(command_type(command), phase, end - start)
 
-    def __readBytes(self):
+    def __responseLength(self, command):
         """
-            Read serial output as a stream of bytes
+            Expected reply length of a query, None if unknown
         """
-        out = []
-        while self.ser.inWaiting() > 0:
-            out.append(ord(self.ser.read(1)))
+        return self.RESPONSE_LENGTH.get(command.rstrip("?0123456789"))
+
+    def __waitResponse(self, command):
+        """
+            Block until the reply to command is complete, that is when:
+             * the expected number of bytes has been received
+             * or the line stayed silent INTER_BYTE_TIMEOUT after the last byte
+             * or no byte at all arrived within RESPONSE_TIMEOUT
+        """
+        self._firstByteTime = None
+        if self.fixedDelay:
+            # Already waited in __sendCommand
+            return
+
+        expected = self.__responseLength(command)
+        deadline = monotonic() + self.RESPONSE_TIMEOUT
+        received = 0
+        lastByteTime = None
+        while True:
+            waiting = self.ser.in_waiting
+            now = monotonic()
+            if waiting != received:
+                received = waiting
+                lastByteTime = now
+                if self._firstByteTime is None:
+                    self._firstByteTime = now
+
+            if expected is not None and received >= expected:
+                return
+            if lastByteTime is None:
+                if now >= deadline:
+                    return
+            elif now - lastByteTime >= self.INTER_BYTE_TIMEOUT:
+                return
+            sleep(self.POLL_INTERVAL)
+
+    def __receive(self, command):
+        """
+            Read the reply to command into the receive buffer with a single
+            read and return its length
+        """
+        self.__waitResponse(command)
+        length = min(self.ser.in_waiting, self.RX_BUFFER_SIZE)
+        if length > 0:
+            length = self.ser.readinto(self._rxView[:length])
+
+        if self.latencyRecorder is not None:
+            if self._firstByteTime is not None:
+                self.__recordLatency(command, 'first_byte',
+                                     self._lastCommandTime, self._firstByteTime)
+            self.__recordLatency(command, 'complete', self._lastCommandTime, monotonic())
 
         if self.DEBUG:
-            print("<< ", ["0x{:02x}".format(v) for v in out])
+            print("<< ", bytes(self._rxView[:length]))
 
-        return out
+        return length
 
-    def __readOutput(self):
+    def submitQuery(self, command):
+        """
+            Queue a query without waiting for its reply (pipelined mode),
+            returns a concurrent.futures.Future of the raw reply
         """
-            Read serial otput as a string
+        if self._pipeline is None:
+            raise TenmaException("submitQuery() needs the pipelined transport")
+        with self._lock:
+            if self.DEBUG:
+                print(">> ", command)
+            return self._pipeline.submit(command,
+                                         query=True,
+                                         length=self.__responseLength(command))
+
+    def query(self, command):
         """
-        out = ""
-        while self.ser.inWaiting() > 0:
-            out += self.ser.read(1).decode('ascii')
+            Send a query and return the raw reply, empty if the unit
+            did not answer
+        """
+        if self._pipeline is not None:
+            try:
+                reply = self.submitQuery(command).result(self.PIPELINE_TIMEOUT)
+            except concurrent.futures.TimeoutError:
+                raise TenmaException("No reply to {command} within {timeout}s".format(
+                    command=command,
+                    timeout=self.PIPELINE_TIMEOUT))
+            if self.DEBUG:
+                print("<< ", reply)
+            return reply
+        with self._lock:
+            self.__sendCommand(command)
+            length = self.__receive(command)
+            return bytes(self._rxView[:length])
 
-        if self.DEBUG:
-            print("<< ", out)
-            
-        if len(out) > 5:
-            out = out[:5]
-        elif len(out) == 0:
-            out = '0'
+    def __queryValue(self, command):
+        """
+            Send a query and parse the numeric reply, 0 if the unit
+            did not answer
+        """
+        if self._pipeline is not None:
+            reply = self.query(command)[:self.VALUE_LENGTH]
+            return float(reply) if reply else 0.0
+        with self._lock:
+            self.__sendCommand(command)
+            length = min(self.__receive(command), self.VALUE_LENGTH)
+            if length == 0:
+                return 0.0
+            return float(self._rxView[:length])
 
-        return out
+    def __queryString(self, command):
+        """
+            Send a query and return the numeric reply as a string
+        """
+        return self.query(command)[:self.VALUE_LENGTH].decode('ascii') or '0'
 
     def getVersion(self):
         """
             Returns a single string with the version of the Tenma Device and Protocol user
         """
-        self.__sendCommand("*IDN?")
-        return self.__readOutput()
+        ver = self.query("*IDN?").decode('ascii')
+        if self._detectionCache is not None:
+            self._detectionCache.check(self._detectionKey, ver)
+        return ver
+
+    def readStatus(self):
+        """
+            Query the power supply status, returns a TenmaStatus
+        """
+        statusBytes = self.query("STATUS?")
+
+        if len(statusBytes) > 1:
+            raise TenmaException("Received more bytes than expected when reading status")
+        if len(statusBytes) == 0:
+            raise TenmaException("No status received")
+
+        with self._lock:
+            self._status = TenmaStatus(statusBytes[0] | self._protectionFlags)
+            self._statusTime = monotonic()
+            self._statusStale = False
+            return self._status
+
+    def getCachedStatus(self, maxAge=None):
+        """
+            Returns the last TenmaStatus read, only querying the unit if a
+            command that could change the status was sent since, or if it
+            is older than maxAge seconds.
+
+            The load may still switch the unit between C.V and C.C without
+            any command: use maxAge or invalidateStatus() in that case.
+        """
+        with self._lock:
+            if (self._statusStale
+                    or (maxAge is not None and monotonic() - self._statusTime > maxAge)):
+                return self.readStatus()
+            return self._status
+
+    def invalidateStatus(self):
+        """
+            Force the next getCachedStatus() to query the unit
+        """
+        self._statusStale = True
 
     def getStatus(self):
         """
@@ -150,65 +755,34 @@ class Tenma72Base(object):
             * lockEnabled: True | False
             * outEnabled: True | False
         """
-        self.__sendCommand("STATUS?")
-        statusBytes = self.__readBytes()
-
-        if len(statusBytes) > 1:
-            raise TenmaException("Received more bytes than expected when reading status")
-
-        status = statusBytes[0]
-
-        ch1mode = (status & 0x01)
-        ch2mode = (status & 0x02)
-        tracking = (status & 0x0C) >> 2
-        beep = (status & 0x10)
-        lock = (status & 0x20)
-        out = (status & 0x40)
-
-        if tracking == 0:
-            tracking = "Independent"
-        elif tracking == 1:
-            tracking = "Tracking Series"
-        elif tracking == 3:
-            tracking = "Tracking Parallel"
-        else:
-            tracking = "Unknown"
-
-        return {
-            "ch1Mode": "C.V" if ch1mode else "C.C",
-            "ch2Mode": "C.V" if ch2mode else "C.C",
-            "Tracking": tracking,
-            "BeepEnabled": bool(beep),
-            "lockEnabled": bool(lock),
-            "outEnabled": bool(out)
-        }
+        return self.readStatus().asDict()
 
     def readCurrent(self, channel):
         "Returns the output current setting."
-        if channel > self.NCHANNELS:
+        if channel < 1 or channel > self.NCHANNELS:
             raise TenmaException("Trying to read CH{channel} with only {nch} channels".format(
                 channel=channel,
                 nch=self.NCHANNELS
             ))
 
-        commandCheck = "ISET{channel}?".format(channel=1)
-        self.__sendCommand(commandCheck)
-        return float(self.__readOutput())
+        commandCheck = "ISET{channel}?".format(channel=channel)
+        current = self.__queryValue(commandCheck)
+        self._setpoints[("I", channel)] = round(current * 1000)
+        return current
 
     def getCurrent(self, channel):
         "Returns the actual output current."
-        if channel > self.NCHANNELS:
+        if channel < 1 or channel > self.NCHANNELS:
             raise TenmaException("Trying to read CH{channel} with only {nch} channels".format(
                 channel=channel,
                 nch=self.NCHANNELS
             ))
 
-        commandCheck = "IOUT{channel}?".format(channel=1)
-        self.__sendCommand(commandCheck)
-        return float(self.__readOutput())
+        commandCheck = "IOUT{channel}?".format(channel=channel)
+        return self.__queryValue(commandCheck)
 
     def setCurrent(self, channel, mA):
-        if channel > self.NCHANNELS:
+        if channel < 1 or channel > self.NCHANNELS:
             raise TenmaException("Trying to set CH{channel} with only {nch} channels".format(
                 channel=channel,
                 nch=self.NCHANNELS
@@ -224,33 +798,24 @@ class Tenma72Base(object):
         command = "ISET{channel}:{amperes:.3f}"
 
         A = float(mA) / 1000.0
-        command = command.format(channel=1, amperes=A)
+        command = command.format(channel=channel, amperes=A)
 
-        self.__sendCommand(command)
-        readcurrent = self.readCurrent(channel)
-
-        if int(readcurrent * 1000) != mA:
-            self.__sendCommand(command)
-            readcurrent = self.readCurrent(channel)
-            if int(readcurrent * 1000) != mA:
-                raise TenmaException("Set {set}mA, but read {read}mA".format(
-                    set=mA,
-                    read=readcurrent * 1000,
-                ))
+        self.__applySetpoint(("I", channel), round(mA), command)
 
     def readVoltage(self, channel):
-        if channel > self.NCHANNELS:
+        if channel < 1 or channel > self.NCHANNELS:
             raise TenmaException("Trying to read CH{channel} with only {nch} channels".format(
                 channel=channel,
                 nch=self.NCHANNELS
             ))
 
-        commandCheck = "VSET{channel}?".format(channel=1)
-        self.__sendCommand(commandCheck)
-        return float(self.__readOutput())
+        commandCheck = "VSET{channel}?".format(channel=channel)
+        volt = self.__queryValue(commandCheck)
+        self._setpoints[("V", channel)] = round(volt * 1000)
+        return volt
 
     def setVoltage(self, channel, mV):
-        if channel > self.NCHANNELS:
+        if channel < 1 or channel > self.NCHANNELS:
             raise TenmaException("Trying to set CH{channel} with only {nch} channels".format(
                 channel=channel,
                 nch=self.NCHANNELS
@@ -266,48 +831,105 @@ class Tenma72Base(object):
         command = "VSET{channel}:{volt:.2f}"
 
         V = float(mV) / 1000.0
-        command = command.format(channel=1, volt=V)
+        command = command.format(channel=channel, volt=V)
 
-        self.__sendCommand(command)
-        readvolt = self.readVoltage(channel)
+        self.__applySetpoint(("V", channel), round(mV), command)
+
+    def __applySetpoint(self, key, value, command):
+        """
+            Program a setpoint, unless it is already programmed,
+            and verify it according to the verify policy
+
+            :param key: ("V" | "I", channel)
+            :param value: Setpoint in mV or mA
+            :param command: VSET or ISET command programming value
+        """
+        with self._lock:
+            if self._setpoints.get(key) == value:
+                return
+
+            self.__sendCommand(command)
+            self._setpoints[key] = value
+
+            if self.verifyPolicy is VerifyPolicy.Always:
+                self.__verifySetpoint(key, command)
+            elif self.verifyPolicy is VerifyPolicy.FirstSet and key not in self._verified:
+                self.__verifySetpoint(key, command)
+            elif self.verifyPolicy is VerifyPolicy.Deferred:
+                self._pendingVerify[key] = command
+
+    def __verifySetpoint(self, key, command):
+        """
+            Read back a setpoint, program it again once on mismatch
+        """
+        kind, channel = key
+        value = self._setpoints[key]
+        unit = "mV" if kind == "V" else "mA"
+        readBack = self.readVoltage if kind == "V" else self.readCurrent
 
-        if int(readvolt * 1000) != int(mV):
+        read = round(readBack(channel) * 1000)
+        if read != value:
             self.__sendCommand(command)
-            readvolt = self.readVoltage(channel)
-            if int(readvolt * 1000) != int(mV):
-                raise TenmaException("Set {set}mV, but read {read}mV".format(
-                    set=mV,
-                    read=readvolt * 1000,
+            read = round(readBack(channel) * 1000)
+            if read != value:
+                # The unit state is unknown, do not trust the cache anymore
+                self._setpoints.pop(key, None)
+                self._verified.discard(key)
+                # The unit may not be the cached model
+                if self._detectionCache is not None:
+                    self._detectionCache.invalidate(self._detectionKey)
+                raise TenmaException("Set {set}{unit}, but read {read}{unit}".format(
+                    set=value,
+                    read=read,
+                    unit=unit,
                 ))
+        self._setpoints[key] = value
+        self._verified.add(key)
+
+    def verifySetpoints(self):
+        """
+            Read back all the setpoints programmed since the last call.
+            Only useful with VerifyPolicy.Deferred.
+        """
+        while self._pendingVerify:
+            key, command = self._pendingVerify.popitem()
+            self.__verifySetpoint(key, command)
+
+    def invalidateSetpoints(self):
+        """
+            Forget the programmed setpoints, next sets are sent to the unit,
+            and read back again under VerifyPolicy.FirstSet
+        """
+        self._setpoints = {}
+        self._verified = set()
+        self._pendingVerify = {}
 
     def runningCurrent(self, channel):
         """
             Returns the current read of a running channel
         """
-        if channel > self.NCHANNELS:
+        if channel < 1 or channel > self.NCHANNELS:
             raise TenmaException("Trying to read CH{channel} with only {nch} channels".format(
                 channel=channel,
                 nch=self.NCHANNELS
             ))
 
         command = "IOUT{channel}?".format(channel=channel)
-        self.__sendCommand(command)
-        readcurrent = self.__readOutput()
+        readcurrent = self.__queryString(command)
         return readcurrent
 
     def runningVoltage(self, channel):
         """
             Returns the voltage read of a running channel
         """
-        if channel > self.NCHANNELS:
+        if channel < 1 or channel > self.NCHANNELS:
             raise TenmaException("Trying to read CH{channel} with only {nch} channels".format(
                 channel=channel,
                 nch=self.NCHANNELS
             ))
 
         command = "VOUT{channel}?".format(channel=channel)
-        self.__sendCommand(command)
-        readvolt = self.__readOutput()
+        readvolt = self.__queryString(command)
         return readvolt
 
     def saveConf(self, conf):
@@ -376,6 +998,8 @@ class Tenma72Base(object):
 
         command = "RCL{conf}".format(conf=conf)
         self.__sendCommand(command)
+        # The memory holds its own setpoints
+        self.invalidateSetpoints()
 
     def setOCP(self, enable=True):
         """
@@ -389,6 +1013,7 @@ class Tenma72Base(object):
         conf = 1 if enable else 0
         command = "OCP{conf}".format(conf=conf)
         self.__sendCommand(command)
+        self.__setProtectionFlag(TenmaStatus.OCP, enable)
 
     def setOVP(self, enable=True):
         """
@@ -402,6 +1027,13 @@ class Tenma72Base(object):
         conf = 1 if enable else 0
         command = "OVP{conf}".format(conf=conf)
         self.__sendCommand(command)
+        self.__setProtectionFlag(TenmaStatus.OVP, enable)
+
+    def __setProtectionFlag(self, flag, enable):
+        if enable:
+            self._protectionFlags |= flag
+        else:
+            self._protectionFlags &= ~flag
 
     def setBEEP(self, enable=True):
         """
@@ -433,6 +1065,7 @@ class Tenma72Base(object):
         self.__sendCommand(command)
 
     def close(self):
+        self.stopPipeline()
         self.ser.close()
 
 #
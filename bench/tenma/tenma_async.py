@@ -0,0 +1,110 @@
+'''
+tenma_async.py - asyncio driver for the Tenma 72-XXXX DC power supplies.
+
+AsyncTenma72 exposes the command set of Tenma72Base as coroutines,
+so a supply command can overlap with relay switching or multimeter waits
+in the same event loop:
+
+    tenma = await AsyncTenma72.open(port)
+    await asyncio.gather(
+        tenma.setVoltage(1, 3500),
+        other_coroutine())
+
+The transport is thread-backed, not asyncio-native: each device owns
+a command queue served by a single I/O thread, running the blocking
+Tenma72Base commands one at a time, in submission order. The event loop
+itself never blocks on the serial port, but each device costs a thread,
+and a command cancelled while it runs still completes on the device.
+An asyncio-native transport (loop.add_reader on the port) is not used:
+the bench COM ports on Windows, like the tenma:// emulator URLs,
+have no file descriptor to select on.
+'''
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from .tenmaDcLib import Tenma72Base, instantiate_tenma_class_from_device_response
+
+
+def _command(name):
+    '''Build the coroutine queuing Tenma72Base.<name>'''
+
+    async def command(self, *args, **kwargs):
+        return await self._submit(getattr(self._tenma, name), *args, **kwargs)
+
+    command.__name__ = name
+    command.__doc__ = getattr(Tenma72Base, name).__doc__
+    return command
+
+
+class AsyncTenma72:
+    '''Coroutines over a blocking Tenma72Base, run by one I/O thread
+    per device (see the module docstring).'''
+
+    def __init__(self, tenma: Tenma72Base):
+        '''
+        tenma: connected Tenma72Base (or subclass) to drive,
+            it shall not be used directly anymore
+        '''
+        self._tenma = tenma
+        # Per device command queue, served by one I/O thread
+        self._executor = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix=f'tenma-{tenma.ser.port}')
+
+    @classmethod
+    async def open(cls, serialPort, debug=False) -> 'AsyncTenma72':
+        '''Connect to the supply on serialPort, detecting its model,
+        from a thread of the default executor.'''
+
+        loop = asyncio.get_running_loop()
+        tenma = await loop.run_in_executor(
+            None,
+            partial(
+                instantiate_tenma_class_from_device_response,
+                serialPort,
+                debug=debug))
+        return cls(tenma)
+
+    @property
+    def tenma(self) -> Tenma72Base:
+        return self._tenma
+
+    async def _submit(self, function, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor,
+            partial(function, *args, **kwargs))
+
+    query = _command('query')
+    getVersion = _command('getVersion')
+    getStatus = _command('getStatus')
+    readCurrent = _command('readCurrent')
+    getCurrent = _command('getCurrent')
+    setCurrent = _command('setCurrent')
+    readVoltage = _command('readVoltage')
+    setVoltage = _command('setVoltage')
+    verifySetpoints = _command('verifySetpoints')
+    runningCurrent = _command('runningCurrent')
+    runningVoltage = _command('runningVoltage')
+    saveConf = _command('saveConf')
+    saveConfFlow = _command('saveConfFlow')
+    recallConf = _command('recallConf')
+    setOCP = _command('setOCP')
+    setOVP = _command('setOVP')
+    setBEEP = _command('setBEEP')
+    ON = _command('ON')
+    OFF = _command('OFF')
+
+    async def close(self):
+        '''Close the port once the queued commands are done.'''
+
+        await self._submit(self._tenma.close)
+        self._executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -1,36 +1,209 @@
-from time import sleep
+from concurrent.futures import Future, ThreadPoolExecutor
+from time import sleep, monotonic
+from typing import Callable, Iterable, Iterator, NamedTuple, Optional
 
-from .tenmaDcLib import Tenma72_2535
+from .tenmaDcLib import (
+    Tenma72_2535, TenmaStatus, VerifyPolicy,
+    instantiate_tenma_class_from_device_response)
+from .tenma_telemetry import Tenma72Telemetry
 
-from ..utils.utils import enumerate_serial, autoselect_serial
+from ..utils.utils import (
+    enumerate_serial, autoselect_serial,
+    get_all_serial_with_serial_number)
+
+VENDOR_PRODUCT_ID = 'VID:PID=0416:5011'
+
+
+class SweepPoint(NamedTuple):
+    setpoint: int       # mV
+    timestamp: float    # time.monotonic() of the readback
+    readback: int       # Actual output voltage (mV)
+
+
+class Preset(NamedTuple):
+    voltage: int        # mV
+    current: int        # mA
 
 
 class Tenma_72_2535_manage:
 
-    def __init__(self, vendor_product_id='VID:PID=0416:5011', debug=False):
-        # Seek for all connected device
-        available_serial_port = enumerate_serial()
-        # Select the port
-        alim_serial_port = autoselect_serial(
-            available_serial_port,
-            (vendor_product_id,))
-        # Instantiate Tenma72_2535
-        self.tenma72_2535 = Tenma72_2535(
+    def __init__(
+            self,
+            vendor_product_id=VENDOR_PRODUCT_ID,
+            debug=False,
+            fixed_delay=False,
+            verify_policy=VerifyPolicy.Always,
+            serial_port=None,
+            pipelined=False,
+            max_in_flight=4,
+            learn_command_gap=False,
+            record_latency=False):
+        '''
+        pipelined: queue the commands instead of waiting for each of them,
+            see Tenma72Base.startPipeline()
+        max_in_flight: maximum number of queries waiting for their reply
+        learn_command_gap: measure the shortest delay between two commands
+            the device accepts, instead of using the default one
+        record_latency: record the latency of each command,
+            see latency_report()
+        '''
+        if serial_port is None:
+            # Seek for all connected device
+            available_serial_port = enumerate_serial()
+            # Select the port
+            alim_serial_port = autoselect_serial(
+                available_serial_port,
+                (vendor_product_id,))
+        else:
+            alim_serial_port = serial_port
+        # Instantiate the detected model, cached from one session to the next.
+        # An unknown model gets the limits of the bench Tenma72_2535
+        self.tenma72_2535 = instantiate_tenma_class_from_device_response(
             alim_serial_port,
-            debug=debug)
+            debug=debug,
+            fallbackModel=Tenma72_2535,
+            fixedDelay=fixed_delay,
+            verifyPolicy=verify_policy)
+        self._latency_recorder = None
+        if record_latency:
+            self._latency_recorder = self.tenma72_2535.recordLatency()
         if self.tenma72_2535.ser.is_open:
             self._comm_port_status = 'Open'
+            if learn_command_gap:
+                self.tenma72_2535.learnCommandGap()
+            if pipelined:
+                self.tenma72_2535.startPipeline(max_in_flight)
         else:
             self._comm_port_status = 'Close'
+        # Mirror of the device state:
+        #   'output': 'ON' | 'OFF'
+        #   ('voltage', channel): mV
+        #   ('current', channel): mA
+        self._mirror = {}
+        # Mirror entries which may not match the device
+        self._dirty = set()
+        self._telemetry = None
+        # time.monotonic() of the last command changing the setpoints,
+        # telemetry samples taken before are stale
+        self._last_setting_time = 0
+        # Operating points stored in the device memories, {slot: Preset}
+        self._presets = {}
+        # Slots whose content has been checked since provisioning
+        self._verified_presets = set()
+        if self._comm_port_status == 'Open':
+            self.sync()
+
+    def sync(self) -> dict:
+        '''Reload the mirror from the device.
+
+        Return the entries which didn't match the device,
+        as {entry: (mirror value, device value)}.'''
+
+        # The device may have been changed from its front panel
+        self.tenma72_2535.invalidateSetpoints()
+        device = {
+            'output': (
+                'ON' if self.tenma72_2535.readStatus().outEnabled
+                else 'OFF')}
+        for channel in range(1, self.tenma72_2535.NCHANNELS + 1):
+            device[('voltage', channel)] = round(
+                self.tenma72_2535.readVoltage(channel) * 1000)
+            device[('current', channel)] = round(
+                self.tenma72_2535.readCurrent(channel) * 1000)
+        mismatches = {}
+        for entry, value in device.items():
+            if self._mirror.get(entry) != value:
+                mismatches[entry] = (self._mirror.get(entry), value)
+            self._mirror[entry] = value
+            self._dirty.discard(entry)
+        self.state = self._mirror['output']
+        return mismatches
+
+    def provision_presets(self, presets: dict) -> list[int]:
+        '''Store operating points in the device memories (M1 to M5).
+
+        presets: {slot: (voltage in mV, current in mA)}
+
+        Each slot is recalled and only written again if its content differs,
+        so provisioning at each session doesn't wear the memories.
+        Whatever they held before (e.g. operating points stored from the
+        front panel) is overwritten.
+        Recalling a slot applies its voltage and current setpoints
+        to the output at once, without switching it: the output is turned
+        OFF first, so the load never sees the successive slots.
+        Return the slots which have been written.'''
+
+        self.power('OFF')
+        written = []
+        for slot, (voltage, current) in presets.items():
+            preset = Preset(voltage // 10 * 10, current)
+            if not self._check_preset_slot(slot, preset):
+                self._write_preset_slot(slot, preset)
+                written.append(slot)
+            self._presets[slot] = preset
+            self._verified_presets.add(slot)
+            self._mirror[('voltage', 1)] = preset.voltage
+            self._mirror[('current', 1)] = preset.current
+        return written
+
+    def recall_preset(self, slot: int, verify: Optional[bool] = None) -> Preset:
+        '''Apply a provisioned operating point with a single RCL command.
+
+        Recalling a slot applies its voltage and current setpoints,
+        and shall not switch the output: a verified recall also checks
+        the output state, and restores it if it changed.
+
+        verify: read back the recalled setpoints, and write the slot again
+        if it has been changed (e.g. from the front panel).
+        By default, only the first recall of each slot is verified.'''
+
+        preset = self._presets[slot]
+        entries = (('voltage', 1), ('current', 1))
+        if (
+                self._mirror.get(entries[0]) == preset.voltage
+                and self._mirror.get(entries[1]) == preset.current
+                and not self._dirty.intersection(entries)):
+            return preset
+
+        # Stay dirty if the recall fails
+        self._dirty.update(entries)
+        self.tenma72_2535.recallConf(slot)
+        self._last_setting_time = monotonic()
+        if verify is None:
+            verify = slot not in self._verified_presets
+        if verify:
+            if not self._check_preset_slot(slot, preset, recall=False):
+                self._write_preset_slot(slot, preset)
+            # Recalling a slot shall not change the output state
+            output = (
+                'ON' if self.tenma72_2535.readStatus().outEnabled
+                else 'OFF')
+            if output != self._mirror.get('output'):
+                self._dirty.add('output')
+                self.power(self._mirror.get('output', 'OFF'))
+            self._verified_presets.add(slot)
+        self._mirror[entries[0]] = preset.voltage
+        self._mirror[entries[1]] = preset.current
+        self._dirty.difference_update(entries)
+        return preset
+
+    def get_preset_slot(self, voltage: int, current: int) -> Optional[int]:
+        '''Return the slot holding (voltage, current), None if there is none.'''
+
+        preset = Preset(voltage // 10 * 10, current)
+        for slot, slot_preset in self._presets.items():
+            if slot_preset == preset:
+                return slot
+        return None
 
     def power(self, state: str, verbose=False) -> str:
         if state == 'ON':
-            self.tenma72_2535.ON()
+            self._write('output', 'ON', self.tenma72_2535.ON)
         elif state == 'OFF':
-            self.tenma72_2535.OFF()
+            self._write('output', 'OFF', self.tenma72_2535.OFF)
         else:
             state = 'OFF'
-            self.tenma72_2535.OFF()
+            self._write('output', 'OFF', self.tenma72_2535.OFF)
             print('Command shall be ON or OFF.')
             print('Power set to OFF.')
         if verbose:
@@ -43,25 +216,301 @@ class Tenma_72_2535_manage:
 
         #  Value shall be a mulitple of 10mV
         value = value // 10 * 10
-        self.tenma72_2535.setVoltage(channel, value)
+        self._write(
+            ('voltage', channel), value,
+            self.tenma72_2535.setVoltage, channel, value)
         return value
 
     def set_current(self, value: int = 0, channel: int = 1) -> int:
         '''Set the current value (in mA)'''
 
-        self.tenma72_2535.setCurrent(channel, value)
+        self._write(
+            ('current', channel), value,
+            self.tenma72_2535.setCurrent, channel, value)
         return value
 
     def get_current(self, channel: int = 1) -> int:
         '''Get the actual output current (in mA)'''
 
+        current = self._telemetry_value('current', channel)
+        if current is not None:
+            return current
         return int(self.tenma72_2535.getCurrent(channel) * 1000)
 
+    def get_status(self, max_age: Optional[float] = None) -> TenmaStatus:
+        '''Get the device status.
+
+        It is only read again from the device after a command which
+        could change it, or if it is older than max_age seconds.'''
+
+        return self.tenma72_2535.getCachedStatus(max_age)
+
+    def get_voltage(self, channel: int = 1) -> int:
+        '''Get the actual output voltage (in mV)'''
+
+        voltage = self._telemetry_value('voltage', channel)
+        if voltage is not None:
+            return voltage
+        return self._query_voltage(channel)
+
+    def _telemetry_value(self, quantity: str, channel: int) -> Optional[int]:
+        '''Latest telemetry sample of quantity on channel, None if there is
+        none, if the telemetry stopped, or if the sample is older than
+        the last setting command.'''
+
+        telemetry = self._telemetry
+        if (
+                telemetry is None
+                or telemetry.channel != channel
+                or not telemetry.is_alive()):
+            return None
+        sample = telemetry.latest_sample(quantity)
+        if sample is None or sample.timestamp < self._last_setting_time:
+            return None
+        return sample.value
+
+    def start_telemetry(
+            self,
+            channel: int = 1,
+            size: int = 1024) -> Tenma72Telemetry:
+        '''Sample the output voltage and current in background.
+
+        While it runs, get_voltage() and get_current() return
+        the latest samples instead of querying the device, as long as
+        they were taken after the last setting command.'''
+
+        if self._telemetry is None:
+            self._telemetry = Tenma72Telemetry(
+                self.tenma72_2535,
+                channel=channel,
+                size=size)
+            self._telemetry.start()
+        return self._telemetry
+
+    def stop_telemetry(self):
+        if self._telemetry is not None:
+            self._telemetry.stop()
+            self._telemetry = None
+
+    def sweep(
+            self,
+            setpoints: Optional[list[int]] = None,
+            start: Optional[int] = None,
+            stop: Optional[int] = None,
+            step: Optional[int] = None,
+            dwell: float = 0,
+            settle: Optional[int] = None,
+            settle_timeout: float = 2,
+            callback: Optional[Callable[[SweepPoint], None]] = None,
+            channel: int = 1) -> Iterator[SweepPoint]:
+        '''Walk the output voltage through setpoints (in mV).
+
+        The setpoints are either given as a list,
+        or from start to stop (included) by step.
+
+        At each step, once the voltage is set:
+            wait dwell seconds,
+            then, if settle is set, wait until the output voltage
+            is within settle mV of the setpoint (at most settle_timeout s),
+            then read the output voltage, call callback with the result
+            and yield it as a SweepPoint.
+
+        The setpoints are sent without VSET? read-back, the output voltage
+        readback already checks them. Only the last one is read back,
+        when the sweep ends.
+
+        Raise ValueError, before any setpoint is sent, if setpoints
+        is not given and start, stop or step is missing, or step is 0.'''
+
+        if setpoints is None:
+            for name, value in (('start', start), ('stop', stop), ('step', step)):
+                if value is None:
+                    raise ValueError(f'sweep: {name} is required without setpoints')
+            if step == 0:
+                raise ValueError('sweep: step must not be 0')
+            step = abs(step) if start <= stop else -abs(step)
+            setpoints = range(start, stop + (1 if step > 0 else -1), step)
+        return self._sweep(
+            setpoints, dwell, settle, settle_timeout, callback, channel)
+
+    def _sweep(
+            self,
+            setpoints: Iterable[int],
+            dwell: float,
+            settle: Optional[int],
+            settle_timeout: float,
+            callback: Optional[Callable[[SweepPoint], None]],
+            channel: int) -> Iterator[SweepPoint]:
+        verify_policy = self.tenma72_2535.verifyPolicy
+        self.tenma72_2535.verifyPolicy = VerifyPolicy.Deferred
+        try:
+            for setpoint in setpoints:
+                setpoint = self.set_voltage(setpoint, channel)
+                if dwell:
+                    sleep(dwell)
+                readback = self._query_voltage(channel)
+                if settle is not None:
+                    deadline = monotonic() + settle_timeout
+                    while (
+                            abs(readback - setpoint) > settle
+                            and monotonic() < deadline):
+                        readback = self._query_voltage(channel)
+                point = SweepPoint(setpoint, monotonic(), readback)
+                if callback is not None:
+                    callback(point)
+                yield point
+            self.tenma72_2535.verifySetpoints()
+        finally:
+            self.tenma72_2535.verifyPolicy = verify_policy
+
+    def latency_report(self) -> Optional[str]:
+        '''Return the p50/p95/p99 latencies (ms) of each command type,
+        None if they are not recorded.'''
+
+        if self._latency_recorder is None:
+            return None
+        return self._latency_recorder.report()
+
     def disconnect(self):
+        self.stop_telemetry()
         if self._comm_port_status == 'Open':
+            # Always send OFF, whatever the mirror says
+            self._dirty.add('output')
             self.power('OFF')
             self.tenma72_2535.close()
             self._comm_port_status = 'Close'
 
+    def _check_preset_slot(
+            self,
+            slot: int,
+            preset: Preset,
+            recall: bool = True) -> bool:
+        '''Return True if the slot holds preset.'''
+
+        if recall:
+            self.tenma72_2535.recallConf(slot)
+            self._last_setting_time = monotonic()
+        voltage = round(self.tenma72_2535.readVoltage(1) * 1000)
+        current = round(self.tenma72_2535.readCurrent(1) * 1000)
+        return Preset(voltage, current) == preset
+
+    def _write_preset_slot(self, slot: int, preset: Preset):
+        # SAV only stores the panel setting in the recalled slot
+        self.tenma72_2535.recallConf(slot)
+        self.tenma72_2535.setVoltage(1, preset.voltage)
+        self.tenma72_2535.setCurrent(1, preset.current)
+        self.tenma72_2535.saveConf(slot)
+        self._last_setting_time = monotonic()
+
+    def _query_voltage(self, channel: int = 1) -> int:
+        return round(float(self.tenma72_2535.runningVoltage(channel)) * 1000)
+
+    def _write(self, entry, value, command, *args):
+        '''Send command(*args) unless the mirror says it is redundant.'''
+
+        if entry not in self._dirty and self._mirror.get(entry) == value:
+            return
+        # Stays dirty if the command fails
+        self._dirty.add(entry)
+        command(*args)
+        self._last_setting_time = monotonic()
+        self._mirror[entry] = value
+        self._dirty.discard(entry)
+
     def __del__(self):
         self.disconnect()
+
+
+class Tenma_72_2535_pool:
+    '''Drive every connected Tenma supply, addressed by USB serial number
+    (by USB location for supplies sharing the same serial number).
+
+    Each supply owns an I/O thread: submit() queues a call on one supply
+    and returns a Future, so several supplies work at the same time,
+    while the calls on one supply stay in order.
+
+        pool = Tenma_72_2535_pool()
+        futures = [
+            pool.submit(serial_number, 'set_voltage', 3500)
+            for serial_number in pool.serial_numbers()]
+        for future in futures:
+            future.result()
+    '''
+
+    def __init__(
+            self,
+            vendor_product_id=VENDOR_PRODUCT_ID,
+            **kwargs):
+        '''kwargs are passed to each Tenma_72_2535_manage.'''
+
+        # Seek for all connected device
+        available_serial_port = enumerate_serial()
+        ports = get_all_serial_with_serial_number(
+            available_serial_port,
+            (vendor_product_id,))
+        # One I/O thread per supply, which also opens it
+        self._executors = {}
+        connections = {}
+        for port, serial_number in ports:
+            executor = ThreadPoolExecutor(
+                max_workers=1,
+                thread_name_prefix=f'tenma-{serial_number}')
+            self._executors[serial_number] = executor
+            connections[serial_number] = executor.submit(
+                Tenma_72_2535_manage,
+                vendor_product_id,
+                serial_port=port,
+                **kwargs)
+        self._supplies = {}
+        try:
+            for serial_number, connection in connections.items():
+                self._supplies[serial_number] = connection.result()
+        except Exception:
+            # Release the supplies opened, and the ones still opening
+            for serial_number, connection in connections.items():
+                if serial_number not in self._supplies:
+                    try:
+                        self._supplies[serial_number] = connection.result()
+                    except Exception:
+                        pass
+            self.disconnect()
+            raise
+
+    def serial_numbers(self) -> list[str]:
+        return list(self._supplies)
+
+    def __getitem__(self, serial_number: str) -> Tenma_72_2535_manage:
+        return self._supplies[serial_number]
+
+    def __len__(self) -> int:
+        return len(self._supplies)
+
+    def submit(
+            self,
+            serial_number: str,
+            method: str,
+            *args,
+            **kwargs) -> Future:
+        '''Queue Tenma_72_2535_manage.<method>(*args, **kwargs)
+        on the I/O thread of the supply serial_number.'''
+
+        supply = self._supplies[serial_number]
+        return self._executors[serial_number].submit(
+            getattr(supply, method), *args, **kwargs)
+
+    def map(self, method: str, *args, **kwargs) -> dict:
+        '''Call method on all the supplies at the same time.
+
+        Return {serial_number: result}.'''
+
+        futures = {
+            serial_number: self.submit(serial_number, method, *args, **kwargs)
+            for serial_number in self._supplies}
+        return {
+            serial_number: future.result()
+            for serial_number, future in futures.items()}
+
+    def disconnect(self):
+        self.map('disconnect')
+        for executor in self._executors.values():
+            executor.shutdown()
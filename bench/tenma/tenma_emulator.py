@@ -0,0 +1,241 @@
+'''
+tenma_emulator.py - software model of a Tenma 72-XXXX DC power supply.
+
+TenmaEmulator answers the serial protocol of the supply:
+    *IDN?, STATUS?, VSET/ISET/VOUT/IOUT, OUT, OCP/OVP/BEEP, LOCK, SAV/RCL
+with a configurable response latency, at the serial line speed,
+drops the commands sent too close to each other, and computes the output
+voltage and current from a resistive load model.
+
+It is opened through pyserial with a "tenma://" URL (see protocol_tenma.py),
+so that Tenma72Base and Tenma_72_2535_manage run without hardware:
+
+    Tenma_72_2535_manage(serial_port='tenma://72-2535?latency=0.01&load=33')
+'''
+
+import re
+import threading
+from time import monotonic
+from typing import Optional
+
+from .tenmaDcLib import Tenma72Base, Tenma72_2545
+
+# Commands, replies are formatted as the hardware does
+COMMAND = re.compile(
+    rb'(?P<idn>\*IDN\?)'
+    rb'|(?P<status>STATUS\?)'
+    rb'|(?P<setting>VSET|ISET|VOUT|IOUT)(?P<channel>\d)'
+    rb'(?:(?P<query>\?)|:(?P<value>\d+(?:\.\d*)?))'
+    rb'|(?P<switch>OUT|OCP|OVP|BEEP|LOCK)(?P<state>[01])'
+    rb'|(?P<memory>SAV|RCL)(?P<slot>\d)')
+# Emulator attribute driven by each switch command
+SWITCHES = {
+    b'OUT': 'output',
+    b'OCP': 'ocp',
+    b'OVP': 'ovp',
+    b'BEEP': 'beep',
+    b'LOCK': 'lock'}
+
+
+class TenmaEmulator:
+
+    def __init__(
+            self,
+            model: str = '72-2535',
+            latency: float = 0.01,
+            load: Optional[float] = None,
+            baudrate: int = 9600,
+            min_gap: float = 0.0):
+        '''
+        model: model reported by *IDN?, sets the limits
+        latency: delay (s) before the first byte of a reply
+        load: resistance (Ohm) connected to the output, None for no load
+        baudrate: line speed, each byte takes 10 bits
+        min_gap: commands received less than min_gap (s) after
+            the previous one are dropped, as the unit does
+        '''
+        self.model = model
+        self.latency = latency
+        self.load = load
+        self.min_gap = min_gap
+        self._byte_time = 10 / baudrate
+        limits = Tenma72_2545
+        for cls in Tenma72Base.__subclasses__():
+            if cls.MATCH_STR == model:
+                limits = cls
+        self.max_mv = limits.MAX_MV
+        self.max_ma = limits.MAX_MA
+        self.nconfs = limits.NCONFS
+        # Panel setting
+        self.voltage = 0        # mV
+        self.current = 0        # mA
+        self.output = False
+        self.ocp = False
+        self.ovp = False
+        self.beep = True
+        self.lock = False
+        self.memories = {slot: (0, 0) for slot in range(1, self.nconfs + 1)}
+        # Reply bytes not read yet, with the time they are on the line
+        self._replies = bytearray()
+        self._ready_times = []
+        self._lock = threading.Lock()
+        # Time the line is free for the next byte sent by the host
+        self._line_free_time = 0
+        # Reception time of the last command processed
+        self._last_command_time = None
+        # Commands received and dropped, for inspection
+        self.commands = []
+        self.dropped = []
+
+    def write(self, data: bytes):
+        '''Process the commands in data.'''
+
+        # Bytes are received one after the other at line speed
+        start = max(monotonic(), self._line_free_time)
+        self._line_free_time = start + len(data) * self._byte_time
+        position = 0
+        while position < len(data):
+            match = COMMAND.match(data, position)
+            if match is None:
+                # The unit silently ignores what it doesn't understand
+                position += 1
+                continue
+            position = match.end()
+            received = start + position * self._byte_time
+            command = match.group().decode('ascii')
+            if (
+                    self._last_command_time is not None
+                    and
+                    received - self._last_command_time < self.min_gap):
+                self.dropped.append(command)
+                continue
+            self._last_command_time = received
+            self.commands.append(command)
+            reply = self._execute(match)
+            if reply:
+                self._reply(reply, received)
+
+    def in_waiting(self) -> int:
+        '''Number of reply bytes already received by the host.'''
+
+        now = monotonic()
+        with self._lock:
+            count = 0
+            for ready_time in self._ready_times:
+                if ready_time > now:
+                    break
+                count += 1
+            return count
+
+    def next_byte_time(self) -> Optional[float]:
+        '''Time the next reply byte is on the line, None if there is none.'''
+
+        with self._lock:
+            if self._ready_times:
+                return self._ready_times[0]
+            return None
+
+    def read(self, size: int) -> bytes:
+        '''Read at most size reply bytes already received by the host.'''
+
+        size = min(size, self.in_waiting())
+        with self._lock:
+            data = bytes(self._replies[:size])
+            del self._replies[:size]
+            del self._ready_times[:size]
+        return data
+
+    def reset(self):
+        '''Drop the reply bytes not read yet.'''
+
+        with self._lock:
+            self._replies.clear()
+            self._ready_times.clear()
+
+    def output_voltage(self) -> int:
+        '''Actual output voltage (mV).'''
+
+        return self._output()[0]
+
+    def output_current(self) -> int:
+        '''Actual output current (mA).'''
+
+        return self._output()[1]
+
+    def is_constant_voltage(self) -> bool:
+        return self._output()[2]
+
+    def status(self) -> int:
+        return (
+            (0x01 if self.is_constant_voltage() else 0)
+            | (0x10 if self.beep else 0)
+            | (0x20 if self.lock else 0)
+            | (0x40 if self.output else 0))
+
+    def _output(self) -> tuple:
+        '''(voltage in mV, current in mA, constant voltage mode)'''
+
+        if not self.output:
+            return 0, 0, True
+        if not self.load:
+            return self.voltage, 0, True
+        current = self.voltage / self.load
+        if current <= self.current:
+            return self.voltage, round(current), True
+        # Constant current mode
+        return round(self.current * self.load), self.current, False
+
+    def _execute(self, match) -> bytes:
+        if match.group('idn'):
+            return f'TENMA {self.model} V2.0'.encode('ascii')
+        if match.group('status'):
+            return bytes([self.status()])
+        if match.group('setting'):
+            return self._execute_setting(match)
+        if match.group('switch'):
+            state = match.group('state') == b'1'
+            setattr(self, SWITCHES[match.group('switch')], state)
+            return b''
+        slot = int(match.group('slot'))
+        if slot in self.memories:
+            if match.group('memory') == b'SAV':
+                self.memories[slot] = (self.voltage, self.current)
+            else:
+                self.voltage, self.current = self.memories[slot]
+        return b''
+
+    def _execute_setting(self, match) -> bytes:
+        setting = match.group('setting')
+        if int(match.group('channel')) != 1:
+            return b''
+        if match.group('query'):
+            if setting == b'VSET':
+                return self._format_voltage(self.voltage)
+            if setting == b'ISET':
+                return self._format_current(self.current)
+            if setting == b'VOUT':
+                return self._format_voltage(self.output_voltage())
+            return self._format_current(self.output_current())
+        value = round(float(match.group('value')) * 1000)
+        if setting == b'VSET' and value <= self.max_mv:
+            # 10 mV resolution
+            self.voltage = value // 10 * 10
+        elif setting == b'ISET' and value <= self.max_ma:
+            self.current = value
+        return b''
+
+    def _format_voltage(self, mV: int) -> bytes:
+        return f'{mV / 1000:05.2f}'.encode('ascii')
+
+    def _format_current(self, mA: int) -> bytes:
+        return f'{mA / 1000:.3f}'.encode('ascii')
+
+    def _reply(self, reply: bytes, received: float):
+        with self._lock:
+            # A reply starts once the previous one is on the line
+            start = received + self.latency
+            if self._ready_times:
+                start = max(start, self._ready_times[-1])
+            for index in range(len(reply)):
+                self._ready_times.append(start + (index + 1) * self._byte_time)
+            self._replies += reply
@@ -12,6 +12,26 @@ the kind of measurement.
 
 In order to known the last value measured by the multimeter,
 used the get_measurement() method.
+Every reading is also kept, timestamped, in a ring buffer:
+used get_measurement_after() to get the first reading taken after
+a given time.monotonic() (e.g. once a relay switched), window() to get
+the last readings and count_since() to count the new ones.
+wait_stable() waits until consecutive readings converge,
+instead of sleeping before get_measurement().
+statistics() follows the mean, standard deviation, min and max
+of the readings over a sliding time window.
+wait_for_next_reading(), wait_for_mode() and wait_until() return as soon as
+the reader thread decodes the awaited reading.
+All of these come from Multimeter (see multimeter.py), shared with
+the optical serial cable driver Tenma_72_7730A_serial.
+
+With usb_reader, the HID reports are read by the event thread of a
+UsbAsyncReader (see usb_async_reader.py), shared by all the multimeters,
+instead of a blocking reader thread per multimeter.
+
+With record_path, every raw HID report is recorded (see hid_recording.py),
+and Tenma_72_7730A_replay feeds a recording back through the same parser
+and decoder, without any USB device.
 
 When you end your treatment, in order to close propely the application,
 used the kill() method.
@@ -20,33 +40,181 @@ used the kill() method.
 import usb.core
 import usb.util
 import threading
-from enum import Enum
+from time import sleep, monotonic
+from typing import Callable, Optional
+
+from .hid_recording import HidRecorder, HidRecording
+from .multimeter import MeasurementFunction, MICRO_SCALE, Multimeter
+from .usb_async_reader import AsyncUsbDevice, UsbAsyncReader
+
+# HID report: a header byte 0xFn followed by n data bytes
+HID_REPORT_HEADER = 0xF0
+# A frame holds 11 nibbles (5 digits, range, mode, flags),
+# followed by CR LF
+FRAME_SIZE = 11
+CR = 13
+LF = 10
+# Longest silence (s) between two reports kept by a replay
+REPLAY_MAX_GAP = 5
+
+
+def _decimal_and_multiplier(
+        function: MeasurementFunction,
+        range_value: int) -> tuple[int, int]:
+    '''Position of the decimal point in the displayed digits,
+    and multiplier of the displayed value, for a range.'''
+
+    if function is MeasurementFunction.Voltage:
+        return range_value, 1
+    if function in (
+            MeasurementFunction.Current,
+            MeasurementFunction.Resistance):
+        return (range_value + 1) % 3 + 1, 1000**((range_value + 1) // 3)
+    return 0, 1
+
+
+def _build_decode_table() -> list:
+    '''Return the decoding of each (mode, range) nibbles, indexed by
+    mode << 4 | range, as (MeasurementFunction, factors):
+    factors[n] turns n displayed digits, read as an integer,
+    into the reading in MICRO_SCALE unit.'''
+
+    functions = {function.value: function for function in MeasurementFunction}
+    table = []
+    for mode in range(16):
+        function = functions.get(mode, MeasurementFunction.UnImplemented)
+        for range_value in range(16):
+            decimal, multiplier = _decimal_and_multiplier(function, range_value)
+            factors = tuple(
+                # Digits right of the decimal point are a fraction
+                multiplier * MICRO_SCALE[function] // 10**max(0, count - decimal)
+                for count in range(6))
+            table.append((function, factors))
+    return table
+
+
+DECODE_TABLE = _build_decode_table()
+
+
+def decode_frame(frame) -> tuple[MeasurementFunction, int]:
+    '''Decode an 11 nibble frame: 5 digits, range, mode, flags.
+
+    Return the function and the reading in MICRO_SCALE unit
+    (0 on overflow).'''
+
+    function, factors = DECODE_TABLE[frame[6] << 4 | frame[5]]
+    digits = 0
+    count = 0
+    for index in range(5):
+        digit = frame[index]
+        if digit < 10:
+            digits = digits * 10 + digit
+            count += 1
+        elif digit > 10:
+            # Overflow
+            return function, 0
+    # 10 is a blank digit
+    if frame[8] & 0b100:
+        return function, -digits * factors[count]
+    return function, digits * factors[count]
+
+
+class HidFrameParser:
+    '''Framing state machine of the multimeter HID reports.
+
+    feed() takes the reports as read from the USB endpoint,
+    without copying them, and collects the low nibble of each data byte
+    in a preallocated frame buffer. Once a frame of FRAME_SIZE nibbles
+    is followed by CR LF, on_frame is called with a memoryview
+    of the frame buffer, only valid during the call.
+    Frames of another size are dropped.'''
+
+    def __init__(self, on_frame: Callable[[memoryview], None]):
+        self._on_frame = on_frame
+        self._frame = bytearray(FRAME_SIZE)
+        self._frame_view = memoryview(self._frame)
+        self._length = 0
+        # time.monotonic() of the first nibble of the frame
+        self.frame_time = 0
+        # Too many nibbles since the last CR LF
+        self._overflow = False
+        # Last nibble was a CR
+        self._cr = False
+
+    def reset(self):
+        self._length = 0
+        self._overflow = False
+        self._cr = False
+
+    def feed(self, report) -> int:
+        '''Process a HID report (bytes, array, memoryview...).
 
+        Return the number of frames completed.'''
 
-class MeasurementFunction(Enum):
-    Voltage = 1
-    Current = 8
-    Resistance = 4
-    UnImplemented = -1
+        view = memoryview(report)
+        if len(view) == 0 or view[0] & 0xF0 != HID_REPORT_HEADER:
+            return 0
+        frames = 0
+        for byte in view[1:1 + (view[0] & 0x0F)]:
+            frames += self._feed_nibble(byte & 0x0F)
+        return frames
 
+    def _feed_nibble(self, nibble: int) -> int:
+        if self._cr:
+            self._cr = False
+            if nibble == LF:
+                complete = not self._overflow and self._length == FRAME_SIZE
+                self.reset()
+                if complete:
+                    self._on_frame(self._frame_view)
+                    return 1
+                return 0
+            # The CR was data
+            self._store(CR)
+        if nibble == CR:
+            self._cr = True
+        else:
+            self._store(nibble)
+        return 0
 
-class OvfStatus(Enum):
-    NoOverFlow = 0
-    OverFlow = 1
+    def _store(self, nibble: int):
+        if self._length == 0:
+            self.frame_time = monotonic()
+        if self._length < FRAME_SIZE:
+            self._frame[self._length] = nibble
+            self._length += 1
+        else:
+            self._overflow = True
 
 
-class Tenma_72_7730A_manage(threading.Thread):
+class Tenma_72_7730A_manage(Multimeter):
 
-    def __init__(self, bcdDevice):
-        threading.Thread.__init__(self, daemon=True)
+    def __init__(
+            self,
+            bcdDevice,
+            buffer_size: int = 1024,
+            record_path: Optional[str] = None,
+            usb_reader: Optional[UsbAsyncReader] = None):
+        '''
+        bcdDevice: USB device release number of the multimeter
+        buffer_size: number of readings kept
+        record_path: file to record the raw HID reports in
+        usb_reader: started UsbAsyncReader to read the HID reports with,
+            instead of the thread of this multimeter
+        '''
+        Multimeter.__init__(self, buffer_size)
         self._device = None
         self._configuration = None
         self._interface = None
         self._endpoint = None
-        self._multimeter_data = []
-        self._measurement = 0
-        self._mode = None
-        self._thread_run = True
+        self._usb_reader = usb_reader
+        self._async_device: Optional[AsyncUsbDevice] = None
+        self._parser = HidFrameParser(self._decodePacket)
+        # Serializes the reports and the recorder closing
+        self._report_lock = threading.Lock()
+        self._recorder = None
+        if record_path is not None:
+            self._recorder = HidRecorder(record_path)
 
         try:
             self._connect(bcdDevice)
@@ -60,6 +228,12 @@ class Tenma_72_7730A_manage(threading.Thread):
                 '************************************************************')
 
     def _connect(self, bcdDevice):
+        # Enable HID communication
+        packet = [0x60, 0x09, 0, 0, 3]
+        packet = packet + (64 - len(packet)) * [0]
+        if self._usb_reader is not None:
+            self._async_device = self._usb_reader.open(bcdDevice, bytes(packet))
+            return
         # Find our device
         self._device = usb.core.find(bcdDevice=bcdDevice)
         # Get configuration
@@ -76,104 +250,64 @@ class Tenma_72_7730A_manage(threading.Thread):
                     == usb.util.ENDPOINT_IN
                 )
             )
-        # Enable HID communication
-        packet = [0x60, 0x09, 0, 0, 3]
-        packet = packet + (64 - len(packet)) * [0]
         self._hid_set_report(packet)
 
+    def start(self):
+        if self._async_device is None:
+            threading.Thread.start(self)
+        else:
+            # No thread: the reports come from the usb_reader event thread
+            self._usb_reader.submit(self._async_device, self._on_report)
+
     def run(self):
         while self._thread_run:
-            waiting_for_packet = True
-            self._multimeter_data = []
             try:
-                while waiting_for_packet:
-                    data = self._device.read(
-                        self._endpoint.bEndpointAddress,
-                        self._endpoint.wMaxPacketSize)
-                    if list(data)[0] == 241:
-                        self._multimeter_data.append(list(data)[1] & 0xF)
-                    # Check if all data have been received
-                    if (
-                            len(self._multimeter_data) > 10
-                            and self._multimeter_data[-2] == 13
-                            and self._multimeter_data[-1] == 10):
-                        if len(self._multimeter_data) > 11:
-                            self._multimeter_data[-11:]
-                        waiting_for_packet = False
-                self._decodePacket()
-            except Exception as err:
-                if (
-                        err.backend_error_code == -7
-                        or err.backend_error_code == -116):
-                    # Normal, the read was empty
-                    pass
-                else:
-                    print()
-                    print(f'Error on device: {self._device}')
-                    print(err)
-                    print(err.__class__)
-                    print(err.__doc__)
-                    print(err.__dict__)
-                    print()
-
-    def get_measurement(self) -> int:
-        return int(self._measurement * 1000)
-
-    def get_mode(self) -> str:
-        if self._mode is None:
-            return ''
-        else:
-            return self._mode.name
+                data = self._device.read(
+                    self._endpoint.bEndpointAddress,
+                    self._endpoint.wMaxPacketSize)
+            except usb.core.USBTimeoutError:
+                # Normal, the read was empty
+                continue
+            except usb.core.USBError as err:
+                if err.backend_error_code in (-7, -116):
+                    # Timeout reported by the libusb0 / openusb backends
+                    continue
+                print()
+                print(f'Error on device: {self._device}')
+                print(err)
+                print(err.__class__)
+                print()
+                continue
+            self._on_report(data)
+        if self._recorder is not None:
+            self._recorder.close()
 
-    def _getDigits(self):
-        dig = self._multimeter_data[0:5]
-        s = ""
-        if(max(dig) > 10):
-            # Overflow
-            ovf = OvfStatus.OverFlow
-        else:
-            ovf = OvfStatus.NoOverFlow
-            for i in dig:
-                if(i < 10):
-                    s += str(i)
-        return s, ovf
-
-    def _decodePacket(self):
-        s, ovf = self._getDigits()
-        r = self._multimeter_data[5:11]
-
-        rangeVal = r[0]
-        modeVal = r[1]
-
-        decimal = 0
-        mul = 1
-        # Voltage (V)
-        if modeVal == MeasurementFunction.Voltage.value:
-            self._mode = MeasurementFunction.Voltage
-            decimal = rangeVal
-        # Current (mA)
-        elif modeVal == MeasurementFunction.Current.value:
-            self._mode = MeasurementFunction.Current
-            decimal = (rangeVal + 1) % 3 + 1
-            mul = 1000**((rangeVal + 1) // 3)
-        # Resistance (Ohm)
-        elif modeVal == MeasurementFunction.Resistance.value:
-            self._mode = MeasurementFunction.Resistance
-            decimal = (rangeVal + 1) % 3 + 1
-            mul = 1000**((rangeVal + 1) // 3)
-        else:
-            self._mode = MeasurementFunction.UnImplemented
+    def stop(self):
+        '''Stop reading the multimeter: at once with a usb_reader,
+        which stops with its last multimeter, otherwise once
+        the current USB read of the thread is done.'''
 
-        if ovf == OvfStatus.NoOverFlow:
-            val = float(s[:decimal] + "." + s[decimal:])
-        else:
-            val = 0
+        self._thread_run = False
+        if self._async_device is not None:
+            self._usb_reader.release(self._async_device)
+            with self._report_lock:
+                if self._recorder is not None:
+                    self._recorder.close()
+                    self._recorder = None
 
-        if r[3] & 0b100:
-            val *= -1
-        val *= mul
+    def _on_report(self, report):
+        with self._report_lock:
+            if not self._thread_run:
+                return
+            if self._recorder is not None:
+                self._recorder.record(report)
+            # Complete frames are decoded by _decodePacket()
+            self._parser.feed(report)
 
-        self._measurement = val
+    def _decodePacket(self, frame):
+        function, micro = decode_frame(frame)
+        # Stamped when the frame started
+        self._store_reading(function, micro, self._parser.frame_time)
 
     def _hid_set_report(self, report):
         """ Implements HID SetReport via USB control transfer """
@@ -191,3 +325,53 @@ class Tenma_72_7730A_manage(threading.Thread):
             # the HID payload as a byte array -- e.g. from struct.pack()
             report
         )
+
+
+class Tenma_72_7730A_replay(Tenma_72_7730A_manage):
+    '''Replay a recording of Tenma_72_7730A_manage(record_path=...)
+    through the same HID parser and decoder, without any USB device.
+
+    The readings are timestamped when they are replayed.
+    A silence longer than REPLAY_MAX_GAP between two reports (e.g. between
+    sessions appended to one recording) is replayed as REPLAY_MAX_GAP.
+    The thread ends with the recording.'''
+
+    def __init__(
+            self,
+            path: str,
+            speed: float = 1,
+            buffer_size: int = 1024):
+        '''
+        path: recording to replay
+        speed: 1 for the original timing, 10 for ten times faster...
+            0 for as fast as possible
+        buffer_size: number of readings kept
+        '''
+        self._path = path
+        self._speed = speed
+        Tenma_72_7730A_manage.__init__(self, None, buffer_size)
+
+    def _connect(self, bcdDevice):
+        # No USB device
+        pass
+
+    def run(self):
+        with HidRecording(self._path) as recording:
+            start = monotonic()
+            first = None
+            previous = None
+            for timestamp, report in recording:
+                if not self._thread_run:
+                    report.release()
+                    break
+                if self._speed > 0:
+                    if first is None:
+                        first = timestamp
+                    elif timestamp - previous > REPLAY_MAX_GAP:
+                        first += timestamp - previous - REPLAY_MAX_GAP
+                    previous = timestamp
+                    delay = start + (timestamp - first) / self._speed - monotonic()
+                    if delay > 0:
+                        sleep(delay)
+                self._parser.feed(report)
+                report.release()
@@ -0,0 +1,274 @@
+'''
+tenma_pipeline.py - pipelined command transport of the Tenma 72-XXXX
+DC power supplies.
+
+TenmaPipeline sends the commands of a Tenma72Base from a single I/O thread:
+ * write-only commands (OUT1, VSET1:3.50, BEEP0...) are queued and the
+   caller returns at once, they are sent back-to-back, only spaced by
+   the command gap the unit needs
+ * queries are sent the same way, without waiting for the previous replies,
+   up to max_in_flight of them, and replies are matched to queries
+   in FIFO order, using their known length
+
+A query whose reply length is unknown (*IDN?) is framed on line silence:
+nothing is sent after it until its reply is complete.
+
+If the serial port fails, the thread stops: the pending queries
+and the later submits raise the error.
+
+With a LatencyRecorder, the 'write' (from submit() to the end of the write),
+'first_byte' and 'complete' (from the end of the write) latencies
+of each command type are recorded.
+'''
+
+from collections import deque
+from concurrent.futures import Future
+import threading
+from time import sleep, monotonic
+from typing import NamedTuple, Optional
+
+from ..utils.latency_histogram import LatencyRecorder
+
+
+def command_type(command: str) -> str:
+    '''Command without channel nor value: VSET1:3.50 -> VSET,
+    VSET1? -> VSET?, *IDN? -> *IDN?'''
+
+    name = command.rstrip('?').rstrip('0123456789.:')
+    if command.endswith('?'):
+        return name + '?'
+    return name
+
+
+class _Command(NamedTuple):
+    data: bytes
+    future: Optional[Future]    # None for a write-only command
+    length: Optional[int]       # Reply length, None if framed on silence
+    submitted: float            # time.monotonic() of submit()
+    sent: float = 0             # time.monotonic() of the end of the write
+
+
+class TenmaPipeline(threading.Thread):
+
+    def __init__(
+            self,
+            ser,
+            command_gap: float,
+            max_in_flight: int = 4,
+            response_timeout: float = 0.5,
+            inter_byte_timeout: float = 0.02,
+            poll_interval: float = 0.001):
+        '''
+        ser: open serial port of the unit, only used by this thread
+        command_gap: minimum delay (s) between two commands
+        max_in_flight: maximum number of queries waiting for their reply
+        response_timeout: maximum wait (s) for a reply,
+            once the previous one is complete
+        inter_byte_timeout: line silence (s) ending a reply of unknown length
+        poll_interval: polling period (s) of the input buffer
+        '''
+        threading.Thread.__init__(
+            self,
+            daemon=True,
+            name=f'tenma-pipeline-{ser.port}')
+        self._ser = ser
+        self.command_gap = command_gap
+        self.max_in_flight = max_in_flight
+        self._response_timeout = response_timeout
+        self._inter_byte_timeout = inter_byte_timeout
+        self._poll_interval = poll_interval
+        # Commands not sent yet
+        self._queue = deque()
+        # Queries sent, waiting for their reply
+        self._in_flight = deque()
+        # Time the first query in flight started to wait for its reply,
+        # and received its first byte
+        self._head_time = 0
+        self._head_first_byte = None
+        # Received bytes not matched to a query yet
+        self._rx = bytearray()
+        self._last_byte_time = 0
+        self._last_command_time = 0
+        self._condition = threading.Condition()
+        self._thread_run = True
+        # Serial error which stopped the thread
+        self.error: Optional[Exception] = None
+        # Set to record the latency of each command
+        self.recorder: Optional[LatencyRecorder] = None
+
+    def submit(
+            self,
+            command: str,
+            query: bool = False,
+            length: Optional[int] = None) -> Optional[Future]:
+        '''Queue command.
+
+        query: command expects a reply, of length bytes
+            (None: framed on line silence)
+
+        Return the Future of the raw reply of a query
+        (empty if the unit did not answer), None otherwise.'''
+
+        future = Future() if query else None
+        with self._condition:
+            if self.error is not None:
+                raise RuntimeError(
+                    f'Tenma pipeline failed: {self.error}') from self.error
+            if not self._thread_run:
+                raise RuntimeError('Tenma pipeline is stopped')
+            self._queue.append(
+                _Command(command.encode('ascii'), future, length, monotonic()))
+            self._condition.notify_all()
+        return future
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        '''Wait until every queued command has been sent,
+        and every query answered.
+
+        Return False if timeout (s) expired before.'''
+
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._queue and not self._in_flight,
+                timeout)
+
+    def stop(self):
+        '''Stop once the queued commands are done.'''
+
+        self.flush(self._response_timeout * (len(self._queue) + 1))
+        with self._condition:
+            self._thread_run = False
+            self._condition.notify_all()
+        if self.is_alive():
+            self.join()
+        # Release the callers of the queries left
+        for command in list(self._in_flight) + list(self._queue):
+            if command.future is not None:
+                command.future.set_result(b'')
+        self._in_flight.clear()
+        self._queue.clear()
+
+    def run(self):
+        while True:
+            with self._condition:
+                # Sleep until there is something to send or to receive
+                self._condition.wait_for(
+                    lambda: (
+                        self._queue
+                        or self._in_flight
+                        or not self._thread_run))
+                if not self._thread_run:
+                    break
+            try:
+                self._receive()
+                self._send()
+            except Exception as error:
+                self._fail(error)
+                break
+            sleep(self._poll_interval)
+
+    def _fail(self, error: Exception):
+        '''Stop on a serial error, failing the queries left.'''
+
+        with self._condition:
+            self.error = error
+            self._thread_run = False
+            for command in list(self._in_flight) + list(self._queue):
+                if command.future is not None:
+                    command.future.set_exception(error)
+            self._in_flight.clear()
+            self._queue.clear()
+            self._condition.notify_all()
+
+    def _send(self):
+        with self._condition:
+            if not self._queue:
+                return
+            command = self._queue[0]
+            if self._in_flight:
+                if self._in_flight[-1].length is None:
+                    # Barrier, its reply ends on line silence
+                    return
+                if (
+                        command.future is not None
+                        and
+                        len(self._in_flight) >= self.max_in_flight):
+                    return
+        # Only wait if the previous command is too recent
+        gap = self._last_command_time + self.command_gap - monotonic()
+        if gap > 0:
+            sleep(gap)
+        with self._condition:
+            self._queue.popleft()
+            try:
+                self._ser.write(command.data)
+            except Exception:
+                # Failed by _fail() with the others
+                self._queue.appendleft(command)
+                raise
+            self._last_command_time = monotonic()
+            if self.recorder is not None:
+                self.recorder.record(
+                    command_type(command.data.decode('ascii')),
+                    'write',
+                    self._last_command_time - command.submitted)
+            if command.future is not None:
+                if not self._in_flight:
+                    self._head_time = self._last_command_time
+                    self._head_first_byte = None
+                self._in_flight.append(
+                    command._replace(sent=self._last_command_time))
+            self._condition.notify_all()
+
+    def _receive(self):
+        waiting = self._ser.in_waiting
+        now = monotonic()
+        if waiting:
+            self._rx += self._ser.read(waiting)
+            self._last_byte_time = now
+        with self._condition:
+            while self._in_flight:
+                if self._rx and self._head_first_byte is None:
+                    self._head_first_byte = now
+                reply = self._reply(self._in_flight[0], now)
+                if reply is None:
+                    break
+                command = self._in_flight.popleft()
+                if self.recorder is not None:
+                    self._record(command, now)
+                command.future.set_result(reply)
+                self._head_time = now
+                self._head_first_byte = None
+            if not self._in_flight:
+                # Late bytes of a reply already timed out
+                self._rx.clear()
+            self._condition.notify_all()
+
+    def _record(self, command: _Command, now: float):
+        name = command_type(command.data.decode('ascii'))
+        if self._head_first_byte is not None:
+            self.recorder.record(
+                name, 'first_byte', self._head_first_byte - command.sent)
+        self.recorder.record(name, 'complete', now - command.sent)
+
+    def _reply(self, command: _Command, now: float) -> Optional[bytes]:
+        '''Take the reply of command from the received bytes,
+        None if it is not complete yet.'''
+
+        timed_out = now - self._head_time >= self._response_timeout
+        if command.length is None:
+            if not self._rx:
+                return b'' if timed_out else None
+            if now - self._last_byte_time < self._inter_byte_timeout:
+                return None
+            length = len(self._rx)
+        elif len(self._rx) >= command.length:
+            length = command.length
+        elif timed_out:
+            # Give what has been received, at most
+            length = len(self._rx)
+        else:
+            return None
+        reply = bytes(self._rx[:length])
+        del self._rx[:length]
+        return reply
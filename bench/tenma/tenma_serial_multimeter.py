@@ -0,0 +1,113 @@
+'''
+tenma_serial_multimeter.py - a python script to access data from
+TENMA multimeters 72_7730A through their optical serial cable.
+
+The multimeter sends a 9 character ASCII line per reading
+(see _test_lib/pyTENMA/pyTENMA.py for the format), at 19230 baud,
+7 data bits, odd parity, with RTS low to power the cable.
+The lines come in bursts of two, every second: the previous value again,
+then the new one.
+
+Tenma_72_7730A_serial stores the new value as soon as its line arrives,
+with the same integer units as the HID driver Tenma_72_7730A_manage,
+in the same Multimeter buffer (see multimeter.py): the waits,
+the settling and the statistics work the same with both cables.
+The repeated value only checks the last reading: if it differs,
+the line was garbled, and the repeated value is stored instead.
+'''
+
+from time import monotonic
+from typing import Optional
+
+import serial
+
+from .multimeter import MeasurementFunction, Multimeter
+
+BAUDRATE = 19230
+BITS_PER_CHARACTER = 10     # Start, 7 data, parity, stop
+LINE_SIZE = 9
+# Longest time (s) between the two lines of a burst
+BURST_GAP = 0.1
+# Mode character: (function, factor turning the displayed integer,
+# shifted by its exponent, into MICRO_SCALE unit)
+LINE_MODES = {
+    ord(';'): (MeasurementFunction.Voltage, 1_000),         # 1 mV
+    ord('?'): (MeasurementFunction.Current, 10),            # 10 µA
+    ord('9'): (MeasurementFunction.Current, 10_000),        # 10 mA
+    ord('3'): (MeasurementFunction.Resistance, 100_000)}    # 0.1 Ohm
+NEGATIVE = ord('<')
+# Exponent character of an overload
+OVERLOAD = ord('5')
+
+
+def decode_line(line: bytes) -> Optional[tuple[MeasurementFunction, int]]:
+    '''Decode a 9 character line: exponent, 4 digits, mode, sign, flags.
+
+    Return the function and the reading in MICRO_SCALE unit
+    (0 on overload), None if the line is invalid or its mode unsupported.'''
+
+    if len(line) != LINE_SIZE or not line[:5].isdigit():
+        return None
+    mode = LINE_MODES.get(line[5])
+    if mode is None:
+        return None
+    function, factor = mode
+    if line[0] == OVERLOAD:
+        return function, 0
+    micro = int(line[1:5]) * 10**(line[0] - ord('0')) * factor
+    if line[6] == NEGATIVE:
+        return function, -micro
+    return function, micro
+
+
+class Tenma_72_7730A_serial(Multimeter):
+
+    def __init__(
+            self,
+            port: str,
+            buffer_size: int = 1024,
+            read_timeout: float = 0.5):
+        '''
+        port: serial port of the optical cable
+        buffer_size: number of readings kept
+        read_timeout: longest wait (s) for a line, before checking
+            for a stop request
+        '''
+        Multimeter.__init__(self, buffer_size)
+        self._port = port
+        self._ser = serial.Serial(
+            port,
+            baudrate=BAUDRATE,
+            bytesize=serial.SEVENBITS,
+            parity=serial.PARITY_ODD,
+            stopbits=serial.STOPBITS_ONE,
+            timeout=read_timeout)
+        # Required by the TENMA cable
+        self._ser.rts = False
+        # Last line stored, and time of the last line received
+        self._last_line = None
+        self._last_line_time = 0
+
+    def run(self):
+        while self._thread_run:
+            line = self._ser.readline()
+            if not line:
+                # Timeout: the SEND function is off
+                continue
+            # Stamped when the line started
+            self._on_line(
+                line.rstrip(b'\r\n'),
+                monotonic() - len(line) * BITS_PER_CHARACTER / BAUDRATE)
+        self._ser.close()
+
+    def _on_line(self, line: bytes, timestamp: float):
+        previous_time = self._last_line_time
+        self._last_line_time = timestamp
+        reading = decode_line(line)
+        if reading is None:
+            return
+        if timestamp - previous_time > BURST_GAP and line == self._last_line:
+            # First line of a burst, repeating the last reading
+            return
+        self._last_line = line
+        self._store_reading(*reading, timestamp)
@@ -0,0 +1,130 @@
+'''
+tenma_telemetry.py - background sampling of the output voltage and current
+of a Tenma 72-XXXX DC power supply.
+
+The Tenma72Telemetry thread interleaves VOUT?/IOUT? queries and stores
+each sample in a ring buffer, stamped when its query started. After each
+query, it waits out the command gap the supply needs without holding
+the driver lock: the commands of other threads get the port at once,
+and the sampling rate stays the one of back-to-back queries. Callers then read the latest value, a mean over
+a time window, or wait for a stable value, without any serial traffic
+of their own.
+
+A failed query doesn't stop the sampling: it is counted in error_count
+and kept in error, and its quantity gets no sample.
+
+Voltages are in mV, currents in mA.
+'''
+
+import threading
+from time import sleep, monotonic
+from typing import Optional
+
+from .tenmaDcLib import Tenma72Base
+
+from ..utils.ring_buffer import RingBuffer, Sample
+
+
+class Tenma72Telemetry(threading.Thread):
+
+    def __init__(
+            self,
+            tenma: Tenma72Base,
+            channel: int = 1,
+            size: int = 1024,
+            period: Optional[float] = None):
+        '''
+        tenma: connected Tenma72Base (or subclass) to sample
+        channel: channel to sample
+        size: number of samples kept per quantity
+        period: pause (s) after each query, out of the driver lock
+            (default: until the command gap of tenma has elapsed)
+        '''
+        threading.Thread.__init__(self, daemon=True)
+        self._tenma = tenma
+        self.channel = channel
+        self._period = period
+        self._buffers = {
+            'voltage': RingBuffer(size),
+            'current': RingBuffer(size)}
+        self._thread_run = True
+        # Failed queries, and the last error
+        self.error_count = 0
+        self.error: Optional[Exception] = None
+
+    def run(self):
+        queries = (
+            ('voltage', self._tenma.runningVoltage),
+            ('current', self._tenma.runningCurrent))
+        while self._thread_run:
+            for quantity, query in queries:
+                start = monotonic()
+                try:
+                    value = float(query(self.channel))
+                except Exception as err:
+                    self.error_count += 1
+                    self.error = err
+                    # Don't spin on a failing port
+                    sleep(self._tenma.commandGap)
+                    continue
+                self._buffers[quantity].append(start, round(value * 1000))
+                # Let the other threads take the driver lock
+                pause = self._period
+                if pause is None:
+                    pause = self._tenma.nextCommandTime() - monotonic()
+                if pause > 0:
+                    sleep(pause)
+
+    def stop(self):
+        self._thread_run = False
+        if self.is_alive():
+            self.join()
+
+    def latest(self, quantity: str) -> Optional[int]:
+        '''Return the last 'voltage' or 'current' sample,
+        None if there is none yet.'''
+
+        sample = self._buffers[quantity].latest()
+        if sample is None:
+            return None
+        return sample.value
+
+    def latest_sample(self, quantity: str) -> Optional[Sample]:
+        '''Return the last 'voltage' or 'current' sample, with its time,
+        None if there is none yet.'''
+
+        return self._buffers[quantity].latest()
+
+    def mean(self, quantity: str, window_ms: float) -> Optional[float]:
+        '''Return the mean of the 'voltage' or 'current' samples
+        of the last window_ms, None if there is none.'''
+
+        samples = self._buffers[quantity].since(monotonic() - window_ms / 1000)
+        if not samples:
+            return None
+        return sum(sample.value for sample in samples) / len(samples)
+
+    def wait_until_stable(
+            self,
+            quantity: str,
+            tolerance: int,
+            window_ms: float = 300,
+            timeout: float = 5) -> Optional[float]:
+        '''Wait until the 'voltage' or 'current' samples taken during
+        window_ms, all after this call, stay within tolerance.
+
+        Return their mean, or None if timeout (s) expired before.'''
+
+        start = monotonic()
+        deadline = start + timeout
+        window = window_ms / 1000
+        while True:
+            now = monotonic()
+            if now - start >= window:
+                samples = self._buffers[quantity].since(now - window)
+                values = [sample.value for sample in samples]
+                if len(values) > 1 and max(values) - min(values) <= tolerance:
+                    return sum(values) / len(values)
+            if now >= deadline:
+                return None
+            sleep(self._tenma.commandGap)
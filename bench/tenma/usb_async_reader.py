@@ -0,0 +1,189 @@
+'''
+usb_async_reader.py - asynchronous USB interrupt transfers for the
+TENMA 72-7730A multimeters, with python-libusb1.
+
+A single UsbAsyncReader thread serves every multimeter: each one keeps
+TRANSFERS_PER_DEVICE interrupt IN transfers submitted, and libusb calls
+back with each report as soon as it arrives. An idle multimeter costs
+neither a thread nor a read timeout.
+
+python-libusb1 (pip install libusb1) is optional, and the reader is
+opt-in (discover_multimeters(async_usb=True)): otherwise each multimeter
+reads its reports from its own blocking thread, with pyusb.
+'''
+
+import threading
+from typing import Callable
+
+try:
+    import usb1
+except ImportError:
+    usb1 = None
+
+ASYNC_USB_AVAILABLE = usb1 is not None
+# Transfers kept submitted per device, so none report is missed
+# while a callback runs
+TRANSFERS_PER_DEVICE = 4
+# Longest wait (s) of the event loop, before checking for a stop request
+EVENT_TIMEOUT = 0.1
+# Consecutive failed transfers before giving up a device
+MAX_TRANSFER_ERRORS = 10
+# HID SetReport
+HID_SET_REPORT_REQUEST_TYPE = 0x21  # CLASS | RECIPIENT_INTERFACE | OUT
+HID_SET_REPORT = 9
+CONFIGURATION_DESCRIPTOR_TYPE = 2
+
+
+class AsyncUsbDevice:
+
+    def __init__(self, handle, endpoint: int, packet_size: int):
+        self.handle = handle
+        self.endpoint = endpoint
+        self.packet_size = packet_size
+        self.transfers = []
+        self.active = False
+        # Consecutive failed transfers
+        self.errors = 0
+        # Status of the transfer the device was given up on, None if read
+        self.error = None
+        self.released = False
+
+    def __str__(self) -> str:
+        return str(self.handle.getDevice())
+
+
+class UsbAsyncReader(threading.Thread):
+
+    def __init__(self):
+        if usb1 is None:
+            raise RuntimeError(
+                'UsbAsyncReader needs python-libusb1 (pip install libusb1)')
+        threading.Thread.__init__(self, daemon=True, name='usb-async-reader')
+        self._context = usb1.USBContext()
+        self._devices = []
+        self._lock = threading.Lock()
+        self._thread_run = True
+
+    def open(self, bcd_device: int, hid_report: bytes) -> AsyncUsbDevice:
+        '''Open the device whose release number is bcd_device,
+        select its first configuration and send it hid_report (SetReport).'''
+
+        for device in self._context.getDeviceIterator(skip_on_error=True):
+            if device.getbcdDevice() == bcd_device:
+                break
+        else:
+            raise ValueError(f'No USB device with bcdDevice {bcd_device:#06x}')
+        configuration = next(device.iterConfigurations())
+        setting = next(iter(next(iter(configuration))))
+        # First IN endpoint
+        for endpoint in setting:
+            if endpoint.getAddress() & usb1.ENDPOINT_IN:
+                break
+        handle = device.open()
+        try:
+            handle.setAutoDetachKernelDriver(True)
+        except usb1.USBErrorNotSupported:
+            pass
+        handle.setConfiguration(configuration.getConfigurationValue())
+        handle.claimInterface(setting.getNumber())
+        handle.controlWrite(
+            HID_SET_REPORT_REQUEST_TYPE,
+            HID_SET_REPORT,
+            CONFIGURATION_DESCRIPTOR_TYPE * 0x100,
+            setting.getNumber(),
+            hid_report)
+        async_device = AsyncUsbDevice(
+            handle,
+            endpoint.getAddress(),
+            endpoint.getMaxPacketSize())
+        with self._lock:
+            self._devices.append(async_device)
+        return async_device
+
+    def submit(self, device: AsyncUsbDevice, on_report: Callable):
+        '''Read device continuously: on_report(report) is called
+        from this thread with each report received.'''
+
+        def callback(transfer):
+            status = transfer.getStatus()
+            if status == usb1.TRANSFER_CANCELLED:
+                return
+            if status == usb1.TRANSFER_COMPLETED:
+                device.errors = 0
+                on_report(transfer.getBuffer()[:transfer.getActualLength()])
+            else:
+                device.errors += 1
+                if (
+                        status == usb1.TRANSFER_NO_DEVICE
+                        or
+                        device.errors >= MAX_TRANSFER_ERRORS):
+                    self._give_up(device, status)
+                    return
+            if device.active:
+                transfer.submit()
+
+        device.active = True
+        for _ in range(TRANSFERS_PER_DEVICE):
+            transfer = device.handle.getTransfer()
+            # No timeout: an idle device simply doesn't call back
+            transfer.setInterrupt(
+                device.endpoint,
+                device.packet_size,
+                callback=callback,
+                timeout=0)
+            transfer.submit()
+            device.transfers.append(transfer)
+
+    def cancel(self, device: AsyncUsbDevice):
+        '''Stop reading device.'''
+
+        device.active = False
+        for transfer in device.transfers:
+            if transfer.isSubmitted():
+                transfer.cancel()
+
+    def release(self, device: AsyncUsbDevice):
+        '''Stop reading device and close it,
+        then stop the event thread once every device is released.'''
+
+        self.cancel(device)
+        with self._lock:
+            device.released = True
+            last = all(device.released for device in self._devices)
+        if last:
+            self.stop()
+
+    def _give_up(self, device: AsyncUsbDevice, status: int):
+        if device.error is None:
+            print(
+                f'\nError on device: {device} (transfer status {status}), '
+                'it is no longer read\n')
+        device.error = status
+        self.cancel(device)
+
+    def _close_released(self):
+        with self._lock:
+            for device in list(self._devices):
+                if device.released and not any(
+                        transfer.isSubmitted() for transfer in device.transfers):
+                    device.handle.close()
+                    self._devices.remove(device)
+
+    def run(self):
+        while self._thread_run:
+            self._context.handleEventsTimeout(EVENT_TIMEOUT)
+            self._close_released()
+        with self._lock:
+            for device in self._devices:
+                device.handle.close()
+            self._devices.clear()
+        self._context.close()
+
+    def stop(self):
+        with self._lock:
+            devices = list(self._devices)
+        for device in devices:
+            self.cancel(device)
+        self._thread_run = False
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
@@ -0,0 +1,133 @@
+'''
+This module provides latency histograms, HdrHistogram style.
+
+Latencies are counted in microseconds, in log-linear buckets:
+values below 2 * SUB_BUCKETS get their own bucket, then each power of two
+is split into SUB_BUCKETS buckets, so the relative error stays below
+1 / SUB_BUCKETS (about 3 %) from a microsecond to a minute,
+with a fixed array of a few hundred counters.
+
+LatencyRecorder keeps one histogram per (command, phase),
+e.g. ('VSET?', 'complete'), and prints their percentiles.
+'''
+
+from array import array
+import math
+import threading
+from typing import Optional
+
+# Number of buckets per power of two, a power of two itself
+SUB_BUCKET_BITS = 5
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+# Highest latency counted exactly, longer ones go to the last bucket
+MAX_LATENCY_US = 60_000_000
+
+
+def bucket_index(value: int) -> int:
+    '''Index of the bucket counting value.'''
+
+    if value < 2 * SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - (SUB_BUCKET_BITS + 1)
+    return shift * SUB_BUCKETS + (value >> shift)
+
+
+def bucket_highest_value(index: int) -> int:
+    '''Highest value counted by the bucket index.'''
+
+    shift = max(0, index // SUB_BUCKETS - 1)
+    lowest = (index - shift * SUB_BUCKETS) << shift
+    return lowest + (1 << shift) - 1
+
+
+class LatencyHistogram:
+
+    def __init__(self, max_value: int = MAX_LATENCY_US):
+        self._counts = array('Q', [0]) * (bucket_index(max_value) + 1)
+        self._last_index = len(self._counts) - 1
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value: int):
+        '''Count a latency (µs).'''
+
+        value = max(0, value)
+        self._counts[min(bucket_index(value), self._last_index)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def mean(self) -> Optional[float]:
+        if self.count == 0:
+            return None
+        return self.total / self.count
+
+    def percentile(self, percent: float) -> Optional[int]:
+        '''Latency (µs) that percent of the recorded values don't exceed,
+        None if nothing has been recorded.'''
+
+        if self.count == 0:
+            return None
+        # Rank of the value, at least the first one
+        rank = max(1, math.ceil(self.count * percent / 100))
+        cumulated = 0
+        for index, count in enumerate(self._counts):
+            cumulated += count
+            if cumulated >= rank:
+                return min(bucket_highest_value(index), self.max)
+        return self.max
+
+
+class LatencyRecorder:
+
+    # Percentiles printed by report()
+    PERCENTILES = (50, 95, 99)
+
+    def __init__(self):
+        # {(command, phase): LatencyHistogram}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def record(self, command: str, phase: str, seconds: float):
+        '''Count a latency of phase ('write', 'first_byte', 'complete'...)
+        of command.'''
+
+        with self._lock:
+            histogram = self._histograms.get((command, phase))
+            if histogram is None:
+                histogram = LatencyHistogram()
+                self._histograms[(command, phase)] = histogram
+            histogram.record(round(seconds * 1_000_000))
+
+    def histogram(self, command: str, phase: str) -> Optional[LatencyHistogram]:
+        return self._histograms.get((command, phase))
+
+    def summary(self) -> dict:
+        '''Return {(command, phase): {'count': n, 50: µs, 95: µs, ...}}'''
+
+        with self._lock:
+            summary = {}
+            for key, histogram in sorted(self._histograms.items()):
+                summary[key] = {'count': histogram.count}
+                for percent in self.PERCENTILES:
+                    summary[key][percent] = histogram.percentile(percent)
+                summary[key]['max'] = histogram.max
+            return summary
+
+    def report(self) -> str:
+        '''Return the percentiles of each (command, phase), in ms.'''
+
+        header = ''.join(f'{"p" + str(p):>9}' for p in self.PERCENTILES)
+        lines = [f'{"Command":<10}{"Phase":<12}{"Count":>7}{header}{"max":>9}']
+        for (command, phase), values in self.summary().items():
+            line = f'{command:<10}{phase:<12}{values["count"]:>7}'
+            for percent in self.PERCENTILES:
+                line += f'{values[percent] / 1000:>9.1f}'
+            line += f'{values["max"] / 1000:>9.1f}'
+            lines.append(line)
+        return '\n'.join(lines)
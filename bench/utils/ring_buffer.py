@@ -0,0 +1,102 @@
+'''
+This module provides a fixed size ring buffer of timestamped values.
+
+Timestamps and values are stored in preallocated arrays,
+so appending a sample doesn't allocate any Python object.
+Each sample gets a sequence number, which is its rank since
+the buffer creation (the first sample appended has the number 0).
+'''
+
+from array import array
+import threading
+from typing import NamedTuple, Optional
+
+
+class Sample(NamedTuple):
+    seq: int
+    timestamp: float
+    value: int
+
+
+class RingBuffer:
+
+    def __init__(self, size: int, typecode: str = 'q'):
+        self._size = size
+        self._timestamps = array('d', [0.0]) * size
+        self._values = array(typecode, [0]) * size
+        # Number of samples appended since the buffer creation
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def append(self, timestamp: float, value) -> int:
+        '''Store a sample, overwriting the oldest one if the buffer is full.
+
+        Return the sample sequence number.'''
+
+        with self._lock:
+            seq = self._count
+            index = seq % self._size
+            self._timestamps[index] = timestamp
+            self._values[index] = value
+            self._count = seq + 1
+        return seq
+
+    def count(self) -> int:
+        '''Number of samples appended since the buffer creation.'''
+
+        return self._count
+
+    def __len__(self) -> int:
+        return min(self._count, self._size)
+
+    def latest(self) -> Optional[Sample]:
+        '''Return the last sample, None if the buffer is empty.'''
+
+        with self._lock:
+            if self._count == 0:
+                return None
+            return self._sample(self._count - 1)
+
+    def get(self, seq: int) -> Optional[Sample]:
+        '''Return the sample numbered seq,
+        None if it isn't appended yet or already overwritten.'''
+
+        with self._lock:
+            if seq < max(self._count - self._size, 0) or seq >= self._count:
+                return None
+            return self._sample(seq)
+
+    def since_seq(self, seq: int) -> list[Sample]:
+        '''Return the samples numbered seq or more still in the buffer,
+        oldest first.'''
+
+        with self._lock:
+            first = max(seq, self._count - self._size, 0)
+            return [self._sample(s) for s in range(first, self._count)]
+
+    def since(self, timestamp: float) -> list[Sample]:
+        '''Return the samples taken at timestamp or later, oldest first.'''
+
+        with self._lock:
+            first = self._count
+            oldest = max(self._count - self._size, 0)
+            # Walk back from the newest sample
+            while (
+                    first > oldest
+                    and
+                    self._timestamps[(first - 1) % self._size] >= timestamp):
+                first -= 1
+            return [self._sample(s) for s in range(first, self._count)]
+
+    def first_since(self, timestamp: float) -> Optional[Sample]:
+        '''Return the first sample taken at timestamp or later,
+        None if there is none yet.'''
+
+        samples = self.since(timestamp)
+        if samples:
+            return samples[0]
+        return None
+
+    def _sample(self, seq: int) -> Sample:
+        index = seq % self._size
+        return Sample(seq, self._timestamps[index], self._values[index])
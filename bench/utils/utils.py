@@ -43,6 +43,36 @@ def get_all_serial_with_hwid(available_serial_port, patterns=("STM", "STLink")):
     return all_serial_with_hwid
 
 
+def get_all_serial_with_serial_number(
+        available_serial_port,
+        patterns=("STM", "STLink")) -> list[tuple[str]]:
+    '''Return (port, USB serial number) of the ports matching patterns.
+
+    A port without serial number, or sharing it with another port
+    (many devices report the same one), is identified by its USB location,
+    or else its port name, so each identifier is unique.'''
+    ports = get_all_serial_with_hwid(available_serial_port, patterns)
+    port_infos = [
+        port_info for port_info in available_serial_port
+        if port_info.device in ports]
+    return [
+        (port_info.device, get_port_identifier(port_info, port_infos))
+        for port_info in port_infos]
+
+
+def get_port_identifier(port_info, port_infos) -> str:
+    '''Return the USB serial number of port_info, or, if it has none
+    or shares it with another port of port_infos, its USB location,
+    or else its port name.'''
+    serial_number = port_info.serial_number
+    if serial_number and not any(
+            other.serial_number == serial_number
+            and other.device != port_info.device
+            for other in port_infos):
+        return serial_number
+    return port_info.location or port_info.device
+
+
 class State(Enum):
     Enable = 'Enable'
     Disable = 'Disable'
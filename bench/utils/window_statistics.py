@@ -0,0 +1,146 @@
+'''
+This module provides streaming statistics over a sliding time window
+of the samples of a RingBuffer.
+
+WindowStatistics keeps only its accumulators: the count, the Welford
+running mean and sum of squared deviations, the min and the max.
+Each update() adds the samples appended since the previous one and
+removes the samples older than the window, reading them back from the
+ring buffer, so the cost is O(1) per sample, whatever the window length.
+The min (or max) is only searched again in the ring buffer
+when the sample holding it leaves the window.
+'''
+
+import math
+from time import monotonic
+from typing import NamedTuple, Optional
+
+from .ring_buffer import RingBuffer
+
+
+class Statistics(NamedTuple):
+    count: int
+    mean: Optional[float]
+    stdev: Optional[float]      # Sample standard deviation, 0 below 2 samples
+    min: Optional[int]
+    max: Optional[int]
+
+
+class WindowStatistics:
+
+    def __init__(
+            self,
+            ring_buffer: RingBuffer,
+            duration: Optional[float] = None,
+            since: Optional[float] = None):
+        '''
+        ring_buffer: samples to compute the statistics of
+        duration: window length (s), None to keep every sample since since
+        since: samples taken before (time.monotonic()) are ignored,
+            None to start with the samples still in ring_buffer
+        '''
+        self._ring_buffer = ring_buffer
+        self._duration = duration
+        self._since = since
+        # The window holds the samples numbered first_seq to next_seq - 1
+        self._first_seq = 0
+        self._next_seq = 0
+        self._reset()
+
+    def update(self, now: Optional[float] = None) -> Statistics:
+        '''Slide the window to end at now (time.monotonic(), default: now)
+        and return its statistics.'''
+
+        if now is None:
+            now = monotonic()
+        for sample in self._ring_buffer.since_seq(self._next_seq):
+            if self._since is not None and sample.timestamp < self._since:
+                self._first_seq = sample.seq + 1
+            else:
+                if self._count == 0:
+                    self._first_seq = sample.seq
+                self._add(sample.value)
+            self._next_seq = sample.seq + 1
+        if self._duration is not None:
+            self._evict(now - self._duration)
+        if self._extremum_left:
+            self._search_extremum()
+        return self.statistics()
+
+    def statistics(self) -> Statistics:
+        '''Statistics of the window, as of the last update().'''
+
+        if self._count == 0:
+            return Statistics(0, None, None, None, None)
+        stdev = 0.0
+        if self._count > 1:
+            stdev = math.sqrt(max(0.0, self._m2) / (self._count - 1))
+        return Statistics(self._count, self._mean, stdev, self._min, self._max)
+
+    def _reset(self):
+        self._count = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._min = None
+        self._max = None
+        self._extremum_left = False
+
+    def _add(self, value: int):
+        self._count += 1
+        delta = value - self._mean
+        self._mean += delta / self._count
+        self._m2 += delta * (value - self._mean)
+        if self._min is None or value < self._min:
+            self._min = value
+        if self._max is None or value > self._max:
+            self._max = value
+
+    def _remove(self, value: int):
+        self._count -= 1
+        if self._count == 0:
+            self._reset()
+            return
+        delta = value - self._mean
+        self._mean -= delta / self._count
+        self._m2 -= delta * (value - self._mean)
+        if value == self._min or value == self._max:
+            self._extremum_left = True
+
+    def _evict(self, oldest: float):
+        while self._first_seq < self._next_seq:
+            sample = self._ring_buffer.get(self._first_seq)
+            if sample is None:
+                # Overwritten: the window is longer than the ring buffer
+                self._rebuild(oldest)
+                return
+            if sample.timestamp >= oldest:
+                return
+            if self._count > 0:
+                self._remove(sample.value)
+            self._first_seq += 1
+
+    def _rebuild(self, oldest: float):
+        '''Compute the window again from the samples left in the ring buffer.'''
+
+        self._reset()
+        self._first_seq = self._next_seq
+        for sample in self._ring_buffer.since(oldest):
+            if sample.seq >= self._next_seq:
+                break
+            if self._since is None or sample.timestamp >= self._since:
+                if self._count == 0:
+                    self._first_seq = sample.seq
+                self._add(sample.value)
+
+    def _search_extremum(self):
+        self._extremum_left = False
+        self._min = None
+        self._max = None
+        for seq in range(self._first_seq, self._next_seq):
+            sample = self._ring_buffer.get(seq)
+            if sample is None:
+                continue
+            if self._min is None or sample.value < self._min:
+                self._min = sample.value
+            if self._max is None or sample.value > self._max:
+                self._max = sample.value